@@ -0,0 +1,932 @@
+import os
+import re
+import sys
+import time
+import json
+import struct
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import functools
+import contextlib
+import urllib.parse
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+import ws3
+
+# --- Benchmark Configuration ---
+# Number of synthetic tweets written into the static timeline fixture
+FIXTURE_TWEETS = 300
+# Number of timed scans per extraction engine
+SCAN_REPEATS = 5
+# Synthetic URLs added to the recorded ones for the URL parsing benchmark
+URL_CORPUS_SIZE = 200000
+# Share of corpus entries that repeat an earlier URL (the same media seen again while scrolling)
+URL_REPEAT_RATE = 0.5
+# Tweets appended each time the synthetic infinite timeline nears the bottom
+INFINITE_PAGE_SIZE = 20
+# Scrolls per memory-control mode in the long-session benchmark
+MEMORY_BENCH_SCROLLS = 400
+# Tweets in the end-to-end likes timeline and their relative mix of media kinds
+E2E_TWEETS = 600
+E2E_TWEET_MIX = {'photo': 5, 'video': 2, 'card': 1, 'text': 2}
+# Tweets per timeline response and the delay before each response
+E2E_PAGE_SIZE = 20
+TIMELINE_LATENCY = 0.15
+# Upper bound for one adaptive scroll wait during the end-to-end run
+E2E_SCROLL_MAX_WAIT = 1
+# Accounts in the multi-account benchmark and how many tweets apart their likes start;
+# an offset below E2E_TWEETS makes neighbouring accounts share liked tweets
+ACCOUNT_BENCH_ACCOUNTS = 3
+ACCOUNT_BENCH_OFFSET = E2E_TWEETS // 2
+# Media server behaviour: delay before headers, bytes per second per response (0 = unlimited),
+# and the share of requests answered with HTTP 500, HTTP 429 or a connection dropped mid-body
+MEDIA_LATENCY = 0.02
+MEDIA_BANDWIDTH = 20 * 1024 * 1024
+MEDIA_ERROR_RATE = 0.02
+MEDIA_THROTTLE_RATE = 0.01
+MEDIA_DROP_RATE = 0.02
+# Retry-After seconds sent with every HTTP 429
+THROTTLE_RETRY_AFTER = 1
+# Size of each served photo and video file
+PHOTO_SIZE = 200 * 1024
+VIDEO_SIZE = 2 * 1024 * 1024
+# Saved results that later runs are compared against
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# How much worse than the baseline a result may be before the run fails
+REGRESSION_TOLERANCE = 0.25
+# Extra absolute slack for results that are close to zero and therefore noisy
+REGRESSION_ABSOLUTE_SLACK = {'e2e_checkpoint_overhead_pct': 0.5}
+# Result name endings for which smaller values are better; all other results are rates
+LOWER_IS_BETTER_SUFFIXES = ('_ns', '_ms', '_pct', '_nodes', '_mb')
+
+def build_timeline_fixture(tweet_count=FIXTURE_TWEETS):
+    """Build a static HTML page that mimics the media markup of the likes timeline"""
+    articles = []
+    for i in range(tweet_count):
+        status = f'<a href="/user/status/{1700000000000000000 + i}">status</a>'
+        media_id = f"F{i:014d}"
+        kind = i % 4
+        if kind == 0:
+            body = (f'<div data-testid="tweetPhoto"><img width="500" '
+                    f'src="https://pbs.twimg.com/media/{media_id}?format=png&name=small"></div>')
+        elif kind == 1:
+            body = (f'<div data-testid="videoPlayer"><video '
+                    f'poster="https://pbs.twimg.com/ext_tw_video_thumb/{i}/pu/img/{media_id}.jpg"></video></div>'
+                    f'<img width="500" src="https://pbs.twimg.com/ext_tw_video_thumb/{i}/pu/img/{media_id}.jpg">')
+        elif kind == 2:
+            body = (f'<div data-testid="card.layoutLarge.media"><img width="500" '
+                    f'src="https://pbs.twimg.com/media/{media_id}?format=jpg&name=medium"></div>')
+        else:
+            body = (f'<div style="background-image: url(&quot;https://pbs.twimg.com/media/{media_id}?format=webp&name=small&quot;);"></div>'
+                    f'<img width="20" src="https://pbs.twimg.com/media/{media_id}?format=jpg&name=tiny">')
+        avatar = '<img src="https://pbs.twimg.com/profile_images/1/avatar_normal.jpg">'
+        articles.append(f'<article data-testid="tweet">{avatar}{status}{body}</article>')
+
+    return "<!DOCTYPE html><html><body>" + "\n".join(articles) + "</body></html>"
+
+# Same markup as build_timeline_fixture, generated in the page so the timeline never ends
+INFINITE_TIMELINE_TEMPLATE = r"""<!DOCTYPE html><html><body><main id="timeline"></main><script>
+var next = 0;
+function tweet(i) {
+    var id = 'F' + String(i).padStart(14, '0'), body;
+    if (i % 4 === 0) body = '<div data-testid="tweetPhoto"><img width="500" src="https://pbs.twimg.com/media/' + id + '?format=png&name=small"></div>';
+    else if (i % 4 === 1) body = '<div data-testid="videoPlayer"><video poster="https://pbs.twimg.com/ext_tw_video_thumb/' + i + '/pu/img/' + id + '.jpg"></video></div>';
+    else if (i % 4 === 2) body = '<div data-testid="card.layoutLarge.media"><img width="500" src="https://pbs.twimg.com/media/' + id + '?format=jpg&name=medium"></div>';
+    else body = '<div style="background-image: url(&quot;https://pbs.twimg.com/media/' + id + '?format=webp&name=small&quot;);"></div>';
+    return '<article data-testid="tweet" style="min-height: 300px"><img src="https://pbs.twimg.com/profile_images/1/avatar_normal.jpg">'
+        + '<a href="/user/status/' + (1700000000000000000n + BigInt(i)) + '">status</a><p>' + 'lorem ipsum '.repeat(40) + '</p>' + body + '</article>';
+}
+function more() {
+    var html = '';
+    for (var n = 0; n < PAGE_SIZE; n++) html += tweet(next++);
+    document.getElementById('timeline').insertAdjacentHTML('beforeend', html);
+}
+more();
+window.addEventListener('scroll', function () {
+    while (window.scrollY + 2 * window.innerHeight >= document.body.scrollHeight) more();
+});
+</script></body></html>"""
+
+def build_infinite_timeline_fixture(page_size=INFINITE_PAGE_SIZE):
+    """HTML page that keeps appending tweets, like the real timeline, as it is scrolled"""
+    return INFINITE_TIMELINE_TEMPLATE.replace('PAGE_SIZE', str(page_size))
+
+def serve_directory(path):
+    """Serve a directory over HTTP on a free local port; returns (server, base URL)"""
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=path))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_long_session(driver, url, mode, scrolls=MEMORY_BENCH_SCROLLS):
+    """Scroll the infinite timeline like optimized_scroll_for_media with one memory-control mode"""
+    driver.get(url)
+    ws3.install_media_observer(driver)
+    stats = ws3.new_browser_stats()
+    collected = {}
+    for scroll_count in range(scrolls):
+        start = time.perf_counter()
+        media = ws3.harvest_new_media(driver)
+        stats['scan_times'].append(time.perf_counter() - start)
+        ws3.merge_media_urls(collected, media)
+        ws3.control_browser_memory(driver, stats, scroll_count, mode)
+        driver.execute_script("window.scrollBy(0, window.innerHeight * 0.6);")
+    ws3.merge_media_urls(collected, ws3.harvest_new_media(driver))
+    ws3.sample_browser_metrics(driver, stats, scrolls)
+    return collected, stats
+
+def benchmark_memory_control(driver, base_url):
+    """Compare a long scroll session with and without DOM pruning"""
+    print("=" * 50)
+    print(f"Long-session benchmark - {MEMORY_BENCH_SCROLLS} scrolls of an infinite timeline")
+    print("=" * 50)
+    found = {}
+    results = {}
+    for mode in ("off", "prune"):
+        collected, stats = run_long_session(driver, f"{base_url}/infinite_timeline.html", mode)
+        _, heap, nodes, articles = stats['samples'][-1]
+        window = min(50, len(stats['scan_times']) // 2)
+        first = sum(stats['scan_times'][:window]) / window
+        last = sum(stats['scan_times'][-window:]) / window
+        heap_text = f"{heap/1024/1024:.1f} MB JS heap, " if heap else ""
+        print(f"{mode:>5}: {heap_text}{nodes} DOM nodes, {articles} tweets, "
+              f"scan {first*1000:.1f} ms -> {last*1000:.1f} ms, {len(collected)} media")
+        found[mode] = set(collected)
+        results[f"memory_{mode}_dom_nodes"] = nodes
+        results[f"memory_{mode}_last_scan_ms"] = last * 1000
+        if heap:
+            results[f"memory_{mode}_heap_mb"] = heap / 1024 / 1024
+    
+    problems = []
+    if found["off"] != found["prune"]:
+        problems.append(f"pruning changed the media found ({len(found['off'])} vs {len(found['prune'])})")
+    return results, problems
+
+def count_round_trips(driver):
+    """Wrap driver.execute so every WebDriver command is counted"""
+    counter = {'calls': 0}
+    original_execute = driver.execute
+
+    def counting_execute(driver_command, params=None):
+        counter['calls'] += 1
+        return original_execute(driver_command, params)
+
+    driver.execute = counting_execute
+    return counter
+
+def time_extraction(driver, counter, extractor, repeats=SCAN_REPEATS):
+    """Run an extractor several times and return (urls, round trips per scan, seconds per scan)"""
+    counter['calls'] = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        urls = extractor(driver)
+    elapsed = time.perf_counter() - start
+    return urls, counter['calls'] / repeats, elapsed / repeats
+
+def load_recorded_urls(journal_path=ws3.JOURNAL_FILE):
+    """Media URLs recorded by earlier runs in the progress journal, if there is one"""
+    urls = []
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('url'):
+                    urls.append(record['url'])
+    return urls
+
+def build_url_corpus(size=URL_CORPUS_SIZE, repeat_rate=URL_REPEAT_RATE, seed=1):
+    """Mix of photo, video, thumbnail, profile and UI URLs shaped like what the scraper sees"""
+    rng = random.Random(seed)
+    corpus = load_recorded_urls()
+    while len(corpus) < size:
+        if corpus and rng.random() < repeat_rate:
+            corpus.append(rng.choice(corpus))
+            continue
+        n = rng.randrange(10 ** 18)
+        kind = rng.randrange(6)
+        if kind < 2:
+            corpus.append(f"https://pbs.twimg.com/media/F{n:x}?format={rng.choice(['jpg', 'png', 'webp'])}&name={rng.choice(['small', 'medium', 'large'])}")
+        elif kind == 2:
+            corpus.append(f"https://video.twimg.com/ext_tw_video/{n}/pu/vid/avc1/1280x720/v{n:x}.mp4?tag=12")
+        elif kind == 3:
+            corpus.append(f"https://pbs.twimg.com/ext_tw_video_thumb/{n}/pu/img/T{n:x}.jpg")
+        elif kind == 4:
+            corpus.append(f"https://video.twimg.com/tweet_video/G{n:x}.mp4")
+        else:
+            corpus.append(f"https://pbs.twimg.com/profile_images/{n}/avatar_normal.jpg")
+    return corpus
+
+# The per-call URL handling that MediaKey replaced, kept here as the baseline
+LEGACY_MEDIA_URL_PATTERNS = ['/media/', 'video.twimg', 'ext_tw_video_thumb', 'amplify_video']
+LEGACY_KEY_PATTERNS = [
+    (re.compile(r'/media/([A-Za-z0-9_-]+)'), 'media'),
+    (re.compile(r'/(?:ext_tw_video|amplify_video)/(\d+)/'), 'video'),
+    (re.compile(r'/tweet_video/([A-Za-z0-9_-]+)'), 'video'),
+    (re.compile(r'/(?:ext_tw_video_thumb|amplify_video_thumb)/(\d+)/'), 'thumb'),
+]
+
+def legacy_is_profile_image(url):
+    return ('profile_images' in url or '_bigger.' in url or '_normal.' in url or '_mini.' in url
+            or 'twimg.com/emoji/' in url or '/semantic_core_img/' in url)
+
+def legacy_media_key(url):
+    for pattern, kind in LEGACY_KEY_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f"{kind}:{match.group(1)}"
+    return f"url:{url.split('?')[0]}"
+
+def legacy_pass(urls):
+    """Scraper filter + downloader filter + key, each rescanning the URL string"""
+    keys = set()
+    for url in urls:
+        if legacy_is_profile_image(url):
+            continue
+        if legacy_is_profile_image(url) or not any(p in url for p in LEGACY_MEDIA_URL_PATTERNS):
+            continue
+        keys.add(legacy_media_key(url))
+    return keys
+
+def media_key_pass(urls):
+    """The same work through one cached MediaKey per URL"""
+    keys = set()
+    for url in urls:
+        media = ws3.parse_media_url(url)
+        if media.downloadable:
+            keys.add(media.key)
+    return keys
+
+def benchmark_url_parsing():
+    """Time URL filtering and keying over a large corpus, legacy vs MediaKey"""
+    corpus = build_url_corpus()
+    
+    start = time.perf_counter()
+    legacy_keys = legacy_pass(corpus)
+    legacy_time = time.perf_counter() - start
+    
+    ws3.parse_media_url.cache_clear()
+    start = time.perf_counter()
+    cold_keys = media_key_pass(corpus)
+    cold_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    media_key_pass(corpus)
+    warm_time = time.perf_counter() - start
+    
+    print("=" * 50)
+    print(f"URL parsing benchmark - {len(corpus)} URLs ({len(set(corpus))} distinct)")
+    print("=" * 50)
+    print(f"Legacy substring + regex scans: {legacy_time*1e9/len(corpus):.0f} ns per URL")
+    print(f"MediaKey, cold cache:           {cold_time*1e9/len(corpus):.0f} ns per URL")
+    print(f"MediaKey, warm cache:           {warm_time*1e9/len(corpus):.0f} ns per URL")
+    print(f"Speedup: {legacy_time / cold_time:.1f}x cold, {legacy_time / warm_time:.1f}x warm")
+    
+    results = {
+        'url_cold_ns': cold_time * 1e9 / len(corpus),
+        'url_warm_ns': warm_time * 1e9 / len(corpus),
+    }
+    problems = []
+    if legacy_keys != cold_keys:
+        problems.append(f"URL parsers disagree ({len(legacy_keys)} vs {len(cold_keys)} keys)")
+    else:
+        print(f"Both parsers found the same {len(cold_keys)} media keys")
+    return results, problems
+
+def benchmark_extraction(driver, fixture_url):
+    """Compare the batched extraction script against the per-element WebDriver path"""
+    driver.get(fixture_url)
+    counter = count_round_trips(driver)
+    try:
+        legacy_urls, legacy_trips, legacy_time = time_extraction(driver, counter, ws3.extract_media_from_page_webdriver)
+        batched_urls, batched_trips, batched_time = time_extraction(
+            driver, counter, lambda d: ws3.process_media_records(ws3.extract_media_records(d)))
+    finally:
+        # Drop the counting wrapper so later suites talk to the driver directly
+        del driver.execute
+    
+    print("=" * 50)
+    print(f"Extraction benchmark - {FIXTURE_TWEETS} tweets, {SCAN_REPEATS} scans per engine")
+    print("=" * 50)
+    print(f"WebDriver per-element: {legacy_trips:.0f} round trips, {legacy_time*1000:.1f} ms per scan")
+    print(f"Batched script:        {batched_trips:.0f} round trips, {batched_time*1000:.1f} ms per scan")
+    print(f"Speedup: {legacy_time / batched_time:.1f}x wall time, {legacy_trips / batched_trips:.0f}x fewer round trips")
+    
+    results = {'extraction_batched_scan_ms': batched_time * 1000}
+    problems = []
+    if set(legacy_urls) != set(batched_urls):
+        problems.append(f"extraction engines disagree ({len(legacy_urls)} vs {len(batched_urls)} URLs)")
+    else:
+        print(f"Both engines found the same {len(batched_urls)} URLs")
+    return results, problems
+
+def pick_tweet_kind(i, mix=E2E_TWEET_MIX):
+    """Deterministic tweet kind for position i, weighted by the mix"""
+    return random.Random(i).choices(list(mix), weights=list(mix.values()))[0]
+
+def tweet_id_for(i):
+    return 1700000000000000000 + i
+
+def e2e_tweet_markup(i, base_url):
+    """One synthetic likes-timeline tweet whose media live on the local media server"""
+    kind = pick_tweet_kind(i)
+    avatar = f'<img src="{base_url}/profile_images/1/avatar_normal.jpg">'
+    status = f'<a href="/user/status/{tweet_id_for(i)}">status</a>'
+    if kind == 'photo':
+        body = (f'<div data-testid="tweetPhoto"><img width="500" '
+                f'src="{base_url}/media/P{i:014d}?format=jpg&name=small"></div>')
+    elif kind == 'video':
+        thumb = f"{base_url}/ext_tw_video_thumb/{tweet_id_for(i)}/pu/img/T{i}.jpg"
+        body = f'<div data-testid="videoPlayer"><video poster="{thumb}" src="blob:{base_url}/{i}"></video></div>'
+    elif kind == 'card':
+        body = (f'<div data-testid="card.layoutLarge.media"><img width="500" '
+                f'src="{base_url}/media/C{i:014d}?format=jpg&name=medium"></div>')
+    else:
+        body = ''
+    text = '<p>' + 'lorem ipsum ' * 30 + '</p>'
+    return f'<article data-testid="tweet" style="min-height: 300px">{avatar}{status}{text}{body}</article>'
+
+def expected_e2e_media(tweets=E2E_TWEETS, first=0):
+    """Media keys the scraper should find in the synthetic timeline"""
+    keys = set()
+    for i in range(first, first + tweets):
+        kind = pick_tweet_kind(i)
+        if kind == 'photo':
+            keys.add(f"media:P{i:014d}")
+        elif kind == 'card':
+            keys.add(f"media:C{i:014d}")
+        elif kind == 'video':
+            keys.add(f"video:{tweet_id_for(i)}" if ws3.RESOLVE_VIDEOS else f"thumb:{tweet_id_for(i)}")
+    return keys
+
+# Likes page shell: fetches tweets from the server page by page as it nears the bottom
+E2E_TIMELINE_SHELL = r"""<!DOCTYPE html><html><body><main id="timeline"></main><script>
+var next = 0, loading = false, done = false;
+function nearBottom() { return window.scrollY + 2 * window.innerHeight >= document.body.scrollHeight; }
+function load() {
+    if (loading || done) return;
+    loading = true;
+    fetch('/timeline?first=FIRST_TWEET&start=' + next).then(function (r) { return r.text(); }).then(function (html) {
+        if (html) {
+            document.getElementById('timeline').insertAdjacentHTML('beforeend', html);
+            next += PAGE_SIZE;
+        } else {
+            done = true;
+        }
+        loading = false;
+        if (nearBottom()) load();
+    });
+}
+load();
+window.addEventListener('scroll', function () { if (nearBottom()) load(); });
+</script></body></html>"""
+
+def media_payload(path, size):
+    """Deterministic file body for a media path: a JPEG-framed image or an MP4-boxed video"""
+    filler = hashlib.md5(path.encode()).digest() * (size // 16 + 1)
+    if '/ext_tw_video/' in path:
+        ftyp = struct.pack('>I4s4sI4s4s', 24, b'ftyp', b'isom', 512, b'isom', b'mp41')
+        moov = struct.pack('>I4s', 16, b'moov') + filler[:8]
+        return ftyp + moov + struct.pack('>I4s', size - 40, b'mdat') + filler[:size - 48]
+    return b'\xff\xd8\xff\xe0' + filler[:size - 6] + b'\xff\xd9'
+
+class MediaServerHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the likes page, pbs/video.twimg.com and the syndication
+    endpoint, with tunable latency, bandwidth and error rates (see MEDIA_* settings).
+    """
+    protocol_version = 'HTTP/1.1'
+    stats = None
+    # Random errors, throttling and drops are off for the deterministic checks
+    faults = True
+    # Paths whose next response is cut off halfway, and (path, Range, status) for every media response
+    drop_next = None
+    media_requests = None
+    # Path -> number of upcoming requests answered with HTTP 429, and (time, path, status) for every media request
+    throttle_next = None
+    request_log = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type, extra_headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        base_url = f"http://{self.headers['Host']}"
+        if parsed.path == '/likes':
+            # ?first=N starts the likes at tweet N, so several accounts can share tweets
+            shell = E2E_TIMELINE_SHELL.replace('PAGE_SIZE', str(E2E_PAGE_SIZE))
+            shell = shell.replace('FIRST_TWEET', str(int(query.get('first', ['0'])[0])))
+            self.send_body(200, shell.encode(), 'text/html')
+        elif parsed.path == '/timeline':
+            time.sleep(TIMELINE_LATENCY)
+            first = int(query['first'][0])
+            start = first + int(query['start'][0])
+            end = min(start + E2E_PAGE_SIZE, first + E2E_TWEETS)
+            html = ''.join(e2e_tweet_markup(i, base_url) for i in range(start, end))
+            self.send_body(200, html.encode(), 'text/html')
+        elif parsed.path == '/tweet-result':
+            tweet_id = query['id'][0]
+            i = int(tweet_id) - tweet_id_for(0)
+            variants = [{'content_type': 'video/mp4', 'bitrate': bitrate,
+                         'url': f"{base_url}/ext_tw_video/{tweet_id}/pu/vid/avc1/{res}/V{i}_{bitrate}.mp4"}
+                        for bitrate, res in ((256000, '480x270'), (2176000, '1280x720'))]
+            details = [{'type': 'video', 'video_info': {'variants': variants}}] if pick_tweet_kind(i) == 'video' else []
+            self.send_body(200, json.dumps({'mediaDetails': details}).encode(), 'application/json')
+        elif parsed.path.startswith(('/media/', '/ext_tw_video/', '/ext_tw_video_thumb/', '/profile_images/')):
+            self.serve_media(parsed.path)
+        else:
+            self.send_body(404, b'not found', 'text/plain')
+
+    def serve_media(self, path):
+        time.sleep(MEDIA_LATENCY)
+        if self.throttle_next.get(path):
+            self.throttle_next[path] -= 1
+            self.request_log.append((time.monotonic(), path, 429))
+            self.stats['throttled'] += 1
+            self.send_body(429, b'slow down', 'text/plain', [('Retry-After', str(THROTTLE_RETRY_AFTER))])
+            return
+        self.request_log.append((time.monotonic(), path, 200))
+        roll = random.random() if self.faults else 1.0
+        if roll < MEDIA_ERROR_RATE:
+            self.stats['errors'] += 1
+            self.send_body(500, b'server error', 'text/plain')
+            return
+        if roll < MEDIA_ERROR_RATE + MEDIA_THROTTLE_RATE:
+            self.stats['throttled'] += 1
+            self.send_body(429, b'slow down', 'text/plain', [('Retry-After', str(THROTTLE_RETRY_AFTER))])
+            return
+        
+        body = media_payload(path, VIDEO_SIZE if '/ext_tw_video/' in path else PHOTO_SIZE)
+        etag = '"' + hashlib.md5(path.encode()).hexdigest() + '"'
+        status, headers = 200, [('Accept-Ranges', 'bytes'), ('ETag', etag)]
+        range_match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if range_match and (if_range is None or if_range == etag):
+            start = int(range_match.group(1))
+            end = int(range_match.group(2)) if range_match.group(2) else len(body) - 1
+            if start >= len(body):
+                self.send_body(416, b'', 'text/plain', [('Content-Range', f"bytes */{len(body)}")])
+                return
+            headers.append(('Content-Range', f"bytes {start}-{end}/{len(body)}"))
+            body, status = body[start:end + 1], 206
+        
+        self.media_requests.append((path, self.headers.get('Range'), status))
+        content_type = 'video/mp4' if '/ext_tw_video/' in path else 'image/jpeg'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        
+        # Some connections drop halfway, which the downloader resumes with a Range request
+        if roll < MEDIA_ERROR_RATE + MEDIA_THROTTLE_RATE + MEDIA_DROP_RATE or path in self.drop_next:
+            self.drop_next.discard(path)
+            self.stats['dropped'] += 1
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        
+        # Pace the body to MEDIA_BANDWIDTH
+        chunk_size = 64 * 1024
+        for offset in range(0, len(body), chunk_size):
+            self.wfile.write(body[offset:offset + chunk_size])
+            if MEDIA_BANDWIDTH:
+                time.sleep(chunk_size / MEDIA_BANDWIDTH)
+        self.stats['bytes'] += len(body)
+        self.stats['responses'] += 1
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients hanging up on dropped responses are part of the benchmark
+
+def start_media_server(faults=True):
+    """Start the local media server; returns (server, base URL)"""
+    handler = type('BenchmarkMediaHandler', (MediaServerHandler,),
+                   {'stats': {'responses': 0, 'bytes': 0, 'errors': 0, 'throttled': 0, 'dropped': 0},
+                    'faults': faults, 'drop_next': set(), 'media_requests': [],
+                    'throttle_next': {}, 'request_log': []})
+    server = QuietHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def scraper_settings(work_dir, base_url):
+    """ws3 settings that keep all state files in work_dir and send embed lookups to the local server"""
+    return {
+        'DOWNLOAD_FOLDER': work_dir,
+        'CHECKPOINT_FILE': os.path.join(work_dir, "checkpoint.json"),
+        'JOURNAL_FILE': os.path.join(work_dir, "progress.jsonl"),
+        'MEDIA_INDEX_FILE': os.path.join(work_dir, "media_index.jsonl"),
+        'SYNC_STATE_FILE': os.path.join(work_dir, "sync_state.json"),
+        'DEDUP_REPORT_FILE': os.path.join(work_dir, "dedup_report.json"),
+        'ACCOUNTS_FOLDER': os.path.join(work_dir, "accounts"),
+        'DRIVER_CACHE_FILE': os.path.join(work_dir, "driver_cache.json"),
+        'SYNDICATION_TWEET_URL': f"{base_url}/tweet-result",
+        'SCROLL_MAX_WAIT': E2E_SCROLL_MAX_WAIT,
+    }
+
+def point_scraper_at(work_dir, base_url):
+    """Apply scraper_settings to this process's copy of ws3 and start from empty state"""
+    vars(ws3).update(scraper_settings(work_dir, base_url))
+    ws3._journal = None
+    ws3._media_index = None
+    ws3._metrics = ws3.RunMetrics()
+
+def download_problems(counters, expected_count):
+    """
+    Check how the downloads of a run turned out: every expected media item
+    completed once, none failed, and every indexed file passes ws3.verify_file.
+    The server's injected errors, throttling and drops all have to be absorbed
+    by retries, deferral and resume for this to pass.
+    """
+    problems = []
+    completed = counters.get('downloads_completed', 0)
+    failed = counters.get('downloads_failed', 0)
+    if failed:
+        problems.append(f"{failed} downloads failed")
+    if completed != expected_count:
+        problems.append(f"{completed} downloads completed, expected {expected_count}")
+    
+    index = ws3.get_media_index()
+    rejected = 0
+    for key, path in index.paths.items():
+        full_path = os.path.join(index.download_folder, path)
+        details = index.details.get(key, {})
+        problem = ws3.verify_file(full_path, os.path.getsize(full_path), details)
+        if problem:
+            rejected += 1
+            if rejected <= 5:
+                problems.append(f"{path}: {problem}")
+    if rejected > 5:
+        problems.append(f"{rejected - 5} more downloaded files failed verification")
+    return problems
+
+def benchmark_end_to_end(driver):
+    """
+    Scrape the synthetic timeline with the real optimized_scroll_for_media and
+    download everything with download_media, as main() does.
+    """
+    server, base_url = start_media_server()
+    work_dir = tempfile.mkdtemp(prefix="likes_e2e_")
+    point_scraper_at(work_dir, base_url)
+    metrics = ws3.get_metrics()
+    expected = expected_e2e_media()
+    
+    # The scraper's own progress output goes to a log file to keep the results readable
+    with open(os.path.join(work_dir, "scraper_output.txt"), 'w', encoding='utf-8') as output:
+        with contextlib.redirect_stdout(output):
+            try:
+                driver.get(f"{base_url}/likes")
+                with metrics.phase('scroll'):
+                    media_urls = ws3.optimized_scroll_for_media(driver, target_count=len(expected) * 2)
+                with metrics.timer('full_scan_seconds'):
+                    ws3.extract_media_from_page(driver)
+                with metrics.phase('download'):
+                    ws3.download_media(media_urls, work_dir)
+            finally:
+                ws3.get_journal().close()
+                ws3.get_media_index().close()
+                server.shutdown()
+    
+    report = metrics.report()
+    counters = report['counters']
+    scroll_time = report['phases']['scroll']
+    download_time = report['phases']['download']
+    checkpoint_time = report['histograms'].get('checkpoint_seconds', {}).get('sum', 0)
+    found = {ws3.canonical_media_key(url) for url in media_urls}
+    results = {
+        'e2e_scans_per_second': counters.get('scans', 0) / scroll_time,
+        'e2e_urls_per_second': len(found) / scroll_time,
+        'e2e_download_mb_per_second': counters.get('download_bytes', 0) / 1024 / 1024 / download_time,
+        'e2e_checkpoint_overhead_pct': checkpoint_time / scroll_time * 100,
+        'e2e_full_scan_ms': report['histograms']['full_scan_seconds']['sum'] * 1000,
+    }
+    
+    print("=" * 50)
+    print(f"End-to-end benchmark - {E2E_TWEETS} tweets, mix {E2E_TWEET_MIX}")
+    print("=" * 50)
+    print(f"Scroll:   {scroll_time:.1f}s, {counters.get('scans', 0)} scans ({results['e2e_scans_per_second']:.1f}/s), "
+          f"{len(found)} media ({results['e2e_urls_per_second']:.1f} URLs/s)")
+    print(f"Full-page scan: {results['e2e_full_scan_ms']:.1f} ms")
+    print(f"Checkpoints: {checkpoint_time*1000:.1f} ms total ({results['e2e_checkpoint_overhead_pct']:.2f}% of scroll time)")
+    print(f"Download: {download_time:.1f}s, {counters.get('downloads_completed', 0)} files, "
+          f"{counters.get('downloads_failed', 0)} failed, {results['e2e_download_mb_per_second']:.1f} MB/s")
+    print(f"Media server: {server.RequestHandlerClass.stats}")
+    print(f"Scraper output and state kept in {work_dir}")
+    
+    problems = download_problems(counters, len(expected))
+    if found != expected:
+        problems.append(f"found {len(found)} media, expected {len(expected)} "
+                        f"({len(expected - found)} missing, {len(found - expected)} unexpected)")
+    return results, problems
+
+def benchmark_accounts():
+    """
+    Collect several accounts with overlapping likes through ws3.coordinate_accounts,
+    each in its own process and browser, and check that shared media are fetched once.
+    """
+    server, base_url = start_media_server()
+    work_dir = tempfile.mkdtemp(prefix="likes_accounts_")
+    point_scraper_at(work_dir, base_url)
+    settings = scraper_settings(work_dir, base_url)
+    accounts = [{'username': f"bench{n}", 'login': False, 'target': E2E_TWEETS * 2, 'settings': settings,
+                 'likes_url': f"{base_url}/likes?first={n * ACCOUNT_BENCH_OFFSET}"}
+                for n in range(ACCOUNT_BENCH_ACCOUNTS)]
+    expected = set()
+    for n in range(ACCOUNT_BENCH_ACCOUNTS):
+        expected |= expected_e2e_media(E2E_TWEETS, n * ACCOUNT_BENCH_OFFSET)
+    
+    with open(os.path.join(work_dir, "coordinator_output.txt"), 'w', encoding='utf-8') as output:
+        with contextlib.redirect_stdout(output):
+            try:
+                summaries = ws3.coordinate_accounts(accounts, ws3.MAX_PARALLEL_ACCOUNTS)
+            finally:
+                server.shutdown()
+    
+    report = ws3.get_metrics().report()
+    counters = report['counters']
+    elapsed = report['phases']['scroll'] + report['phases']['download']
+    queued = set(ws3.get_journal().entries)
+    attempted = counters.get('downloads_completed', 0) + counters.get('downloads_failed', 0)
+    results = {
+        'accounts_media_per_second': len(queued) / elapsed,
+        'accounts_download_mb_per_second': counters.get('download_bytes', 0) / 1024 / 1024 / elapsed,
+    }
+    
+    print("=" * 50)
+    print(f"Multi-account benchmark - {ACCOUNT_BENCH_ACCOUNTS} accounts of {E2E_TWEETS} likes, "
+          f"{ws3.MAX_PARALLEL_ACCOUNTS} at a time")
+    print("=" * 50)
+    for summary in summaries:
+        print(f"{summary['username']}: {summary['media']} media in {summary['seconds']:.1f}s")
+    print(f"{len(queued)} distinct media queued, {attempted} downloads "
+          f"({counters.get('downloads_failed', 0)} failed) in {elapsed:.1f}s, {results['accounts_media_per_second']:.1f} media/s")
+    print(f"Coordinator output and state kept in {work_dir}")
+    
+    problems = download_problems(counters, len(expected))
+    if len(summaries) != ACCOUNT_BENCH_ACCOUNTS:
+        problems.append(f"only {len(summaries)} of {ACCOUNT_BENCH_ACCOUNTS} accounts finished")
+    if queued != expected:
+        problems.append(f"accounts queued {len(queued)} media, expected {len(expected)}")
+    if attempted > len(queued):
+        problems.append(f"{attempted} downloads for {len(queued)} distinct media; shared media were fetched twice")
+    return results, problems
+
+def check_downloaded_file(result, path, size):
+    """Problems with a download_single_media result compared with what the server serves for path"""
+    if not isinstance(result, tuple):
+        return [f"{path}: download returned {result!r}"]
+    _, full_path, sha256 = result
+    expected = media_payload(path, size)
+    with open(full_path, 'rb') as f:
+        content = f.read()
+    problems = []
+    if content != expected:
+        problems.append(f"{path}: downloaded bytes differ from the served file")
+    if sha256 != hashlib.sha256(expected).hexdigest():
+        problems.append(f"{path}: reported sha256 does not match the served file")
+    problem = ws3.verify_file(full_path, len(content), {'size': len(expected), 'sha256': sha256})
+    if problem:
+        problems.append(f"{path}: {problem}")
+    return problems
+
+def benchmark_resume():
+    """
+    Deterministic resume checks against the local media server: a connection
+    dropped halfway must be resumed with a Range request, and a partial file left
+    by another variant of the same video must not be resumed against this one.
+    """
+    server, base_url = start_media_server(faults=False)
+    handler = server.RequestHandlerClass
+    work_dir = tempfile.mkdtemp(prefix="likes_resume_")
+    point_scraper_at(work_dir, base_url)
+    tweet_id = tweet_id_for(0)
+    dropped_path = f"/ext_tw_video/{tweet_id}/pu/vid/avc1/1280x720/resume.mp4"
+    low_path = f"/ext_tw_video/{tweet_id + 1}/pu/vid/avc1/480x270/low.mp4"
+    high_path = f"/ext_tw_video/{tweet_id + 1}/pu/vid/avc1/1280x720/high.mp4"
+    problems = []
+    
+    with open(os.path.join(work_dir, "resume_output.txt"), 'w', encoding='utf-8') as output:
+        with contextlib.redirect_stdout(output):
+            try:
+                # The first response stops halfway; the retry must ask for the rest only
+                handler.drop_next.add(dropped_path)
+                result = ws3.download_single_media(base_url + dropped_path, 0, 2, work_dir)
+                problems += check_downloaded_file(result, dropped_path, VIDEO_SIZE)
+                ranges = [(range_header, status) for path, range_header, status in handler.media_requests
+                          if path == dropped_path]
+                if len(ranges) != 2 or ranges[1] != (f"bytes={VIDEO_SIZE // 2}-", 206):
+                    problems.append(f"dropped download was not resumed with a Range request: {ranges}")
+                
+                # A half-downloaded 480p variant shares its part file with the 720p one
+                handler.drop_next.add(low_path)
+                retries, ws3.DOWNLOAD_RETRIES = ws3.DOWNLOAD_RETRIES, 1
+                try:
+                    ws3.download_single_media(base_url + low_path, 1, 2, work_dir)
+                finally:
+                    ws3.DOWNLOAD_RETRIES = retries
+                result = ws3.download_single_media(base_url + high_path, 1, 2, work_dir)
+                problems += check_downloaded_file(result, high_path, VIDEO_SIZE)
+            finally:
+                server.shutdown()
+    
+    print("=" * 50)
+    print("Resume checks - dropped connection, partial file from another variant")
+    print("=" * 50)
+    print("Passed" if not problems else f"{len(problems)} problems, output kept in {work_dir}")
+    return {}, problems
+
+def benchmark_throttle():
+    """
+    Deterministic throttling checks against the local media server: an HTTP 429
+    must pause the host for its Retry-After, a file still throttled after
+    DOWNLOAD_RETRIES attempts must be deferred, and retry_deferred_downloads
+    must fetch it once the rest of the batch is done.
+    """
+    server, base_url = start_media_server(faults=False)
+    handler = server.RequestHandlerClass
+    work_dir = tempfile.mkdtemp(prefix="likes_throttle_")
+    point_scraper_at(work_dir, base_url)
+    tweet_id = tweet_id_for(0)
+    paths = [f"/ext_tw_video/{tweet_id + i}/pu/vid/avc1/1280x720/throttle{i}.mp4" for i in range(4)]
+    
+    # Two files are throttled on every attempt, one only on its first, one never
+    handler.throttle_next.update({paths[0]: ws3.DOWNLOAD_RETRIES, paths[1]: ws3.DOWNLOAD_RETRIES, paths[2]: 1})
+    expected_deferred = {base_url + path for path in paths[:2]}
+    deferred = []
+    retry_deferred_downloads = ws3.retry_deferred_downloads
+    
+    def record_deferred(deferred_urls, download_folder, on_result):
+        deferred.extend(deferred_urls)
+        return retry_deferred_downloads(deferred_urls, download_folder, on_result)
+    
+    with open(os.path.join(work_dir, "throttle_output.txt"), 'w', encoding='utf-8') as output:
+        with contextlib.redirect_stdout(output):
+            ws3.retry_deferred_downloads = record_deferred
+            try:
+                ws3.download_media([base_url + path for path in paths], work_dir)
+            finally:
+                ws3.retry_deferred_downloads = retry_deferred_downloads
+                server.shutdown()
+    
+    counters = ws3.get_metrics().counters
+    problems = download_problems(counters, len(paths))
+    if set(deferred) != expected_deferred:
+        problems.append(f"deferred {sorted(deferred)}, expected {sorted(expected_deferred)}")
+    if counters.get('downloads_deferred', 0) != len(expected_deferred):
+        problems.append(f"{counters.get('downloads_deferred', 0)} downloads deferred, expected {len(expected_deferred)}")
+    if counters.get('throttled_responses', 0) != 2 * ws3.DOWNLOAD_RETRIES + 1:
+        problems.append(f"{counters.get('throttled_responses', 0)} throttled responses seen, "
+                        f"expected {2 * ws3.DOWNLOAD_RETRIES + 1}")
+    
+    # After a 429, the same file must not be asked for again before Retry-After has passed
+    last_throttled = {}
+    for at, path, status in handler.request_log:
+        if path in last_throttled and at - last_throttled.pop(path) < THROTTLE_RETRY_AFTER * 0.9:
+            problems.append(f"{path} was requested again before Retry-After ended")
+        if status == 429:
+            last_throttled[path] = at
+    
+    print("=" * 50)
+    print("Throttle checks - Retry-After pause, deferral and deferred retry")
+    print("=" * 50)
+    print("Passed" if not problems else f"{len(problems)} problems, output kept in {work_dir}")
+    return {}, problems
+
+def lower_is_better(name):
+    return name.endswith(LOWER_IS_BETTER_SUFFIXES)
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(results, path=BASELINE_FILE):
+    """Merge this run's results into the baseline file"""
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f"Saved {len(results)} results to {path}")
+
+def check_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Compare results with the baseline; returns a message for each one that got worse"""
+    print("=" * 50)
+    print(f"Comparison with baseline (tolerance {tolerance:.0%})")
+    print("=" * 50)
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline:
+            print(f"{name:>36}: {value:.2f} (no baseline)")
+            continue
+        reference = baseline[name]
+        slack = REGRESSION_ABSOLUTE_SLACK.get(name, 0)
+        if lower_is_better(name):
+            worse = value > reference * (1 + tolerance) + slack
+        else:
+            worse = value < reference * (1 - tolerance) - slack
+        change = (value - reference) / reference * 100 if reference else 0
+        print(f"{name:>36}: {value:.2f} vs {reference:.2f} ({change:+.0f}%){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(f"{name} went from {reference:.2f} to {value:.2f}")
+    return regressions
+
+def start_benchmark_browser():
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument("--enable-precise-memory-info")
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and regression suite for the likes scraper")
+    parser.add_argument('--suite', choices=['all', 'urls', 'resume', 'throttle', 'extraction', 'memory', 'e2e', 'accounts'],
+                        default='all',
+                        help="which benchmark to run (default: all)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f"store the results in {os.path.basename(BASELINE_FILE)} instead of comparing against it")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="allowed slowdown relative to the baseline, e.g. 0.25 for 25%%")
+    args = parser.parse_args()
+    selected = lambda suite: args.suite in ('all', suite)
+    
+    results = {}
+    problems = []
+    
+    def record(outcome):
+        suite_results, suite_problems = outcome
+        results.update(suite_results)
+        problems.extend(suite_problems)
+    
+    if selected('urls'):
+        record(benchmark_url_parsing())
+    if selected('resume'):
+        record(benchmark_resume())
+    if selected('throttle'):
+        record(benchmark_throttle())
+    
+    if any(selected(suite) for suite in ('extraction', 'memory', 'e2e')):
+        fixture_dir = tempfile.mkdtemp()
+        fixture_path = os.path.join(fixture_dir, "timeline_fixture.html")
+        with open(fixture_path, 'w', encoding='utf-8') as f:
+            f.write(build_timeline_fixture())
+        with open(os.path.join(fixture_dir, "infinite_timeline.html"), 'w', encoding='utf-8') as f:
+            f.write(build_infinite_timeline_fixture())
+        server, base_url = serve_directory(fixture_dir)
+        driver = start_benchmark_browser()
+        
+        try:
+            if selected('extraction'):
+                record(benchmark_extraction(driver, "file://" + fixture_path.replace(os.sep, '/')))
+            if selected('memory'):
+                record(benchmark_memory_control(driver, base_url))
+            if selected('e2e'):
+                record(benchmark_end_to_end(driver))
+        finally:
+            driver.quit()
+            server.shutdown()
+    
+    # Account workers start their own browsers
+    if selected('accounts'):
+        record(benchmark_accounts())
+    
+    if args.save_baseline:
+        save_baseline(results)
+    else:
+        baseline = load_baseline()
+        if baseline:
+            problems.extend(check_regressions(results, baseline, args.tolerance))
+        else:
+            print("No baseline yet; run with --save-baseline to record one")
+    
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
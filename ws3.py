@@ -2,8 +2,24 @@ import re
 import os
 import time
 import json
+import gzip
+import argparse
+import bisect
+import contextlib
+import hashlib
+import struct
+import base64
+import math
+import statistics
+import threading
+import queue
+import multiprocessing
+import random
+import email.utils
+import functools
 import requests
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -11,14 +27,23 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 from webdriver_manager.chrome import ChromeDriverManager
 
+# Pillow is only needed for perceptual (near-duplicate) dedup
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # --- Configuration ---
 X_USERNAME = "USERNAME"
 X_PASSWORD = "PASSWORD"
 PROFILE_URL = f"https://x.com/{X_USERNAME}"
 LIKES_TAB_SELECTOR = "a[href='/USERNAME/likes']"
 TWEET_CONTAINER_SELECTOR = "article[data-testid='tweet']"
+# Only present once logged in
+LOGGED_IN_SELECTOR = "a[data-testid='AppTabBar_Profile_Link'], nav[aria-label='Primary']"
 # More comprehensive selectors to capture all possible media
 IMAGE_SELECTOR = "img[src*='pbs.twimg.com/media/'], img[src*='pbs.twimg.com/ext_tw_video_thumb/']"
 BACKGROUND_IMAGE_DIV_SELECTOR = "div[style*='background-image: url']"
@@ -26,6 +51,12 @@ VIDEO_SELECTOR = "video[src*='video.twimg.com'], div[data-testid='videoPlayer']"
 TWEET_MEDIA_CONTAINER = "div[data-testid='tweetPhoto'], div[data-testid='videoPlayer']"
 DOWNLOAD_FOLDER = "D:/python/x liked"
 CHECKPOINT_FILE = os.path.join(DOWNLOAD_FOLDER, "checkpoint.json")
+JOURNAL_FILE = os.path.join(DOWNLOAD_FOLDER, "progress.jsonl")
+MEDIA_INDEX_FILE = os.path.join(DOWNLOAD_FOLDER, "media_index.jsonl")
+SYNC_STATE_FILE = os.path.join(DOWNLOAD_FOLDER, "sync_state.json")
+DEDUP_REPORT_FILE = os.path.join(DOWNLOAD_FOLDER, "dedup_report.json")
+DRIVER_CACHE_FILE = os.path.join(DOWNLOAD_FOLDER, "driver_cache.json")
+SESSION_COOKIES_FILE = os.path.join(DOWNLOAD_FOLDER, "session_cookies.json")
 
 # --- New Configuration Options ---
 # Target number of media items to collect (increase this to your desired limit)
@@ -38,11 +69,313 @@ SCROLL_PAUSE_TIME = 5
 MAX_SCROLLS = 3000
 # Progress report frequency (every N scrolls)
 PROGRESS_REPORT_FREQ = 10
+# Run the media selectors inside the page with one script call per scan
+# (set to False to fall back to element-by-element WebDriver lookups)
+BATCHED_DOM_EXTRACTION = True
+# Collect only newly inserted media nodes each scroll via an in-page MutationObserver
+# (set to False to rescan the whole page after every scroll)
+INCREMENTAL_HARVEST = True
+# Where media URLs come from: "dom" scrapes the rendered timeline, "network" reads
+# the Likes GraphQL responses through the Chrome DevTools protocol
+CAPTURE_MODE = "dom"
+# Look up each video tweet's highest-bitrate MP4 instead of keeping posters and thumbnails
+RESOLVE_VIDEOS = True
+# Wait only until new content has loaded after each scroll instead of always sleeping SCROLL_PAUSE_TIME
+ADAPTIVE_SCROLL_WAIT = True
+# Shortest and longest adaptive wait (seconds); scrolls that load nothing back off towards the maximum
+SCROLL_MIN_WAIT = 0.25
+SCROLL_MAX_WAIT = SCROLL_PAUSE_TIME
+# How often the page is polled while waiting (seconds)
+SCROLL_POLL_INTERVAL = 0.1
+# Quiet period after the last timeline request before loading counts as settled (seconds)
+NETWORK_IDLE_TIME = 0.5
+# Number of parallel download workers (1 downloads files one at a time)
+DOWNLOAD_WORKERS = 8
+# Maximum simultaneous connections to a single media host
+MAX_CONNECTIONS_PER_HOST = 4
+# Attempts per file before giving up
+DOWNLOAD_RETRIES = 3
+# Sustained requests per second and burst size allowed per media host
+HOST_REQUESTS_PER_SECOND = 10
+HOST_BURST = 20
+# Exponential backoff (with jitter) between retries, in seconds
+RETRY_BACKOFF_BASE = 1
+RETRY_BACKOFF_MAX = 60
+# Extra passes over throttled downloads at the end of the run
+DEFERRED_RETRY_ROUNDS = 2
+# Write buffer size for downloads (bytes)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Files at least this large are fetched as parallel byte ranges (set MULTIPART_SEGMENTS = 1 to disable)
+MULTIPART_MIN_SIZE = 32 * 1024 * 1024
+MULTIPART_SEGMENTS = 4
+# Lean scraping browser: no image decoding, no media autoplay or media requests, small window
+# (set to False for the original maximized window that renders everything)
+LEAN_BROWSER = True
+# Run the lean browser without a window (set to False to watch it, or to complete a login challenge by hand)
+HEADLESS_BROWSER = True
+BROWSER_WINDOW_SIZE = (1000, 1600)
+# Media requests the lean browser blocks; their URLs stay in the page for the extractor
+BLOCKED_URL_PATTERNS = ["*://pbs.twimg.com/*", "*://video.twimg.com/*", "*://abs.twimg.com/emoji/*"]
+# Save the login cookies after a successful login and reuse them to skip logging in next time
+PERSIST_SESSION = True
+# How long to wait for the home timeline when checking a saved session (seconds)
+SESSION_CHECK_TIMEOUT = 10
+# Upper bounds (seconds) of the latency histogram buckets in the run report
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Also write the run metrics in Prometheus text format to this file (e.g. for the
+# node_exporter textfile collector); None to skip
+PROMETHEUS_TEXTFILE = None
+# Start downloading media while the feed is still being scrolled
+PIPELINED_DOWNLOADS = True
+# Maximum discovered URLs waiting for a download worker before scrolling pauses
+PIPELINE_QUEUE_SIZE = 200
+# Journal records written between fsyncs, and the longest time records stay unsynced (seconds)
+JOURNAL_FSYNC_EVERY = 50
+JOURNAL_FSYNC_INTERVAL = 5
+# Compact the journal once it holds this many records per known URL (and at least the minimum)
+JOURNAL_COMPACT_RATIO = 4
+JOURNAL_COMPACT_MIN_RECORDS = 1000
+# Daily sync: stop scrolling once this many consecutive media from earlier runs appear
+SYNC_MODE = False
+SYNC_KNOWN_STREAK = 20
+# Number of newest media keys remembered between sync runs
+SYNC_STATE_SIZE = 500
+# Keep the browser's memory bounded on long sessions: "prune" releases the images and videos
+# of harvested tweets far above the viewport, "off" keeps everything
+MEMORY_CONTROL = "prune"
+# Scrolls between memory checks (prunes and renderer memory samples)
+MEMORY_CONTROL_EVERY = 25
+# Screens of harvested tweets kept intact above the viewport
+PRUNE_MARGIN_SCREENS = 3
+# Look for duplicate files by content hash once downloading is finished
+DEDUP_AFTER_DOWNLOAD = True
+# What happens to byte-identical copies: "hardlink" keeps one copy on disk,
+# "remove" deletes the extra files, "report" only lists them in the dedup report
+DEDUP_ACTION = "hardlink"
+# Also report visually near-identical images using a perceptual hash (needs Pillow)
+PERCEPTUAL_DEDUP = False
+# Largest number of differing bits between two 64-bit perceptual hashes for a near-duplicate
+PERCEPTUAL_HASH_DISTANCE = 4
+# Worker processes for perceptual hashing (None uses every CPU core)
+DEDUP_PROCESSES = None
+# Save the raw media records (or Likes responses in network mode) of every scan to
+# session_<timestamp>.jsonl.gz in the download folder, for offline replay
+RECORD_SESSION = False
+# Worker processes for replaying a recorded session (None uses every CPU core)
+REPLAY_PROCESSES = None
+# Recorded scans handed to a replay worker at a time
+REPLAY_CHUNK_SIZE = 200
+# Size and mtime of files already verified intact, so 'python ws3.py verify' only reads new or changed files
+VERIFY_CACHE_FILE = os.path.join(DOWNLOAD_FOLDER, "verify_cache.json")
+VERIFY_REPORT_FILE = os.path.join(DOWNLOAD_FOLDER, "verify_report.json")
+# Threads reading files during verification
+VERIFY_WORKERS = 16
+# Damaged files are moved to this folder inside the download folder, which queues them for download again
+QUARANTINE_FOLDER = "corrupt"
+# Accounts collected by 'python ws3.py accounts', each a dict with 'username' and 'password'.
+# Optional keys: 'target' (media count), 'likes_url' (open this page instead of the profile's
+# likes tab), 'login' (False skips logging in) and 'settings' (module settings to override)
+ACCOUNTS = []
+# Browser sessions running at once; downloads for all of them share DOWNLOAD_WORKERS
+MAX_PARALLEL_ACCOUNTS = 2
+# Per-account journals, checkpoints, sync state, cookies and output
+ACCOUNTS_FOLDER = os.path.join(DOWNLOAD_FOLDER, "accounts")
+
+class RunMetrics:
+    """
+    Counters, latency histograms and phase timings for one run, plus
+    structured JSON log lines. Download workers record into the same
+    instance, so every update holds the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.phases = {}
+        self.log_file = None
+        # Callables run with this instance whenever the run report is written
+        self.export_hooks = []
+
+    def open_log(self, path):
+        """Append structured log lines to path (one JSON object per line)"""
+        self.log_file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Record the latest value of a level such as memory use"""
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Add one latency sample to a histogram"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'max': 0.0}
+                self.histograms[name] = histogram
+            histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Time a block into a histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase of the run (login, scroll, download, ...)"""
+        self.log('phase_start', phase=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+            self.log('phase_end', phase=name, seconds=round(elapsed, 3))
+
+    def log(self, event, **fields):
+        """Write one structured log line"""
+        if self.log_file is None:
+            return
+        record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'event': event}
+        record.update(fields)
+        line = json.dumps(record)
+        with self.lock:
+            self.log_file.write(line + '\n')
+
+    def quantile(self, name, q):
+        """Estimate a quantile from the histogram's bucket bounds"""
+        histogram = self.histograms[name]
+        rank = q * histogram['count']
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+            seen += count
+            if seen >= rank:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def report(self):
+        """Everything recorded so far as a JSON-ready dict"""
+        with self.lock:
+            duration = time.time() - self.started
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                histograms[name] = {
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 6),
+                    'max': round(histogram['max'], 6),
+                    'p50': self.quantile(name, 0.5),
+                    'p90': self.quantile(name, 0.9),
+                    'p99': self.quantile(name, 0.99),
+                    'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], histogram['buckets'])),
+                }
+            phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        # Pipelined downloads run during the scroll phase as well
+        download_time = phases.get('download', 0) + (phases.get('scroll', 0) if PIPELINED_DOWNLOADS else 0)
+        return {
+            'started': datetime.fromtimestamp(self.started).strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round(duration, 3),
+            'phases': phases,
+            'counters': counters,
+            'gauges': gauges,
+            'throughput': {
+                'scans_per_second': round(counters.get('scans', 0) / max(phases.get('scroll', duration), 0.001), 3),
+                'urls_per_second': round(counters.get('media_found', 0) / max(phases.get('scroll', duration), 0.001), 3),
+                'download_mb_per_second': round(counters.get('download_bytes', 0) / 1024 / 1024 / max(download_time or duration, 0.001), 3),
+            },
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self, prefix='likes_scraper_'):
+        """Render counters, phase timings and histograms in Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}{name}_total counter")
+                lines.append(f"{prefix}{name}_total {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {prefix}{name} gauge")
+                lines.append(f"{prefix}{name} {value}")
+            if self.phases:
+                lines.append(f"# TYPE {prefix}phase_seconds gauge")
+                for name, seconds in sorted(self.phases.items()):
+                    lines.append(f'{prefix}phase_seconds{{phase="{name}"}} {seconds:.6f}')
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'{prefix}{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+                lines.append(f"{prefix}{name}_sum {histogram['sum']:.6f}")
+                lines.append(f"{prefix}{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """Write the JSON run report and run the export hooks"""
+        report = self.report()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_path, path)
+        for hook in self.export_hooks:
+            try:
+                hook(self)
+            except Exception as e:
+                print(f"Metrics export hook failed: {e}")
+        return report
+
+    def print_summary(self):
+        """Print phase timings and the main latency percentiles"""
+        report = self.report()
+        print("\nRun Timing:")
+        for name, seconds in report['phases'].items():
+            print(f"- {name}: {seconds:.1f}s")
+        for name, histogram in report['histograms'].items():
+            print(f"- {name}: {histogram['count']} samples, p50 {histogram['p50']*1000:.0f} ms, "
+                  f"p90 {histogram['p90']*1000:.0f} ms, max {histogram['max']*1000:.0f} ms")
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+def prometheus_textfile_hook(path):
+    """Export hook writing the metrics to a Prometheus textfile-collector file"""
+    def export(metrics):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.to_prometheus())
+        os.replace(temp_path, path)
+    return export
+
+_metrics = RunMetrics()
+
+def get_metrics():
+    """The metrics of the current run"""
+    return _metrics
 
 def is_profile_image(url):
     """Check if the URL is a profile image (we want to skip these)"""
     if not url:
         return True
+    # Plain substring checks beat a combined regex here
     return ('profile_images' in url or 
             '_bigger.' in url or 
             '_normal.' in url or 
@@ -50,102 +383,699 @@ def is_profile_image(url):
             'twimg.com/emoji/' in url or  # Skip emoji images
             '/semantic_core_img/' in url)  # Skip UI elements
 
-def extract_media_from_page(driver):
+# Media identity tokens. Different spellings of the same file (size, format
+# and tag parameters) map to the same ID; GIF videos count as videos.
+MEDIA_IDENTITY_PATTERN = re.compile(
+    r'/media/(?P<media>[A-Za-z0-9_-]+)'
+    r'|/(?:ext_tw_video|amplify_video)/(?P<video>\d+)/'
+    r'|/tweet_video/(?P<gif>[A-Za-z0-9_-]+)'
+    r'|/(?:ext_tw_video_thumb|amplify_video_thumb)/(?P<thumb>\d+)/')
+MEDIA_FORMAT_PATTERN = re.compile(r'format=(\w+)')
+# Hosts that serve video files whatever their path looks like
+VIDEO_HOST_MARKER = 'video.twimg'
+# Number of parsed URLs kept by parse_media_url
+MEDIA_KEY_CACHE_SIZE = 1 << 18
+
+class MediaKey:
     """
-    A comprehensive function to extract all media from the currently loaded page.
+    Everything the scraper and downloader need to know about one media URL,
+    parsed once: kind ('media', 'video', 'thumb' or 'url'), ID, format, the
+    URL to download (full size for photos) and the canonical key string used
+    for dedup, the journal and filenames.
     """
-    media_urls = set()
+    __slots__ = ('kind', 'media_id', 'format', 'raw_url', 'key', 'downloadable')
+
+    def __init__(self, kind, media_id, media_format, raw_url, downloadable):
+        self.kind = kind
+        self.media_id = media_id
+        self.format = media_format
+        self.raw_url = raw_url
+        self.key = f"{kind}:{media_id}"
+        self.downloadable = downloadable
+
+    @property
+    def url(self):
+        """Best-quality URL: original-size JPEG for photos, the URL as found otherwise"""
+        return upgrade_media_url(self.raw_url) if self.kind == 'media' else self.raw_url
+
+    def __eq__(self, other):
+        return isinstance(other, MediaKey) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"MediaKey({self.key!r}, format={self.format!r})"
+
+@functools.lru_cache(maxsize=MEDIA_KEY_CACHE_SIZE)
+def parse_media_url(url):
+    """Parse a raw media URL into its MediaKey (cached, so repeat URLs cost one lookup)"""
+    path = url.split('?', 1)[0]
+    format_match = MEDIA_FORMAT_PATTERN.search(url) if 'format=' in url else None
+    if format_match:
+        media_format = format_match.group(1).lower()
+    else:
+        name = path.rpartition('/')[2]
+        media_format = name.rpartition('.')[2].lower() if '.' in name else None
+    skipped = is_profile_image(url)
+    
+    match = MEDIA_IDENTITY_PATTERN.search(url)
+    if match is None:
+        return MediaKey('url', path, media_format, url, not skipped and VIDEO_HOST_MARKER in url)
     
+    kind = 'video' if match.lastgroup == 'gif' else match.lastgroup
+    return MediaKey(kind, match.group(match.lastgroup), media_format, url, not skipped)
+
+def canonical_media_key(url):
+    """Return a stable identity for a media URL, e.g. 'media:<id>' or 'video:<id>'"""
+    return parse_media_url(url).key
+
+# In-page media collector. Runs every selector family from extract_media_from_page
+# inside the browser so a full scan costs a single WebDriver round trip. Each
+# record is [kind, value, width, tweet_id]; the URL rules stay on the Python side.
+MEDIA_COLLECTOR_JS = r"""
+function __likesCollectMedia(root) {
+    var records = [];
+    function tweetId(el) {
+        var article = el.closest("article[data-testid='tweet']");
+        if (!article) return null;
+        var link = article.querySelector("a[href*='/status/']");
+        if (!link) return null;
+        var match = (link.getAttribute('href') || '').match(/\/status\/(\d+)/);
+        return match ? match[1] : null;
+    }
+    function each(selector, kind, value) {
+        var nodes = Array.prototype.slice.call(root.querySelectorAll(selector));
+        if (root.matches && root.matches(selector)) nodes.push(root);
+        for (var i = 0; i < nodes.length; i++) {
+            var el = nodes[i];
+            records.push([kind, value(el), el.width || null, tweetId(el)]);
+        }
+    }
+    each("div[data-testid='tweetPhoto'] img", 'photo', function (el) { return el.src; });
+    each("div[data-testid='videoPlayer'] video", 'video', function (el) { return el.src; });
+    each("div[data-testid='videoPlayer'] video", 'poster', function (el) { return el.poster; });
+    each("img[src*='ext_tw_video_thumb']", 'thumb', function (el) { return el.src; });
+    each("img[src*='pbs.twimg.com/media/']", 'image', function (el) { return el.src; });
+    each("div[style*='background-image: url']", 'background', function (el) { return el.getAttribute('style'); });
+    each("div[data-testid='card.layoutSmall.media'] img, div[data-testid='card.layoutLarge.media'] img",
+         'card', function (el) { return el.src; });
+    return records;
+}
+"""
+
+MEDIA_EXTRACTION_SCRIPT = MEDIA_COLLECTOR_JS + "\nreturn JSON.stringify(__likesCollectMedia(document));"
+
+# Incremental harvesting. A MutationObserver feeds records for newly inserted or
+# re-pointed media nodes into window.__likesMediaBuffer; records already seen are
+# dropped in-page so each drain only carries new content.
+MEDIA_OBSERVER_SCRIPT = MEDIA_COLLECTOR_JS + r"""
+if (window.__likesMediaObserver) return false;
+var seen = new Set();
+window.__likesMediaBuffer = [];
+function collect(root) {
+    var records = __likesCollectMedia(root);
+    for (var i = 0; i < records.length; i++) {
+        var key = records[i][0] + '|' + records[i][1];
+        if (!records[i][1] || seen.has(key)) continue;
+        seen.add(key);
+        window.__likesMediaBuffer.push(records[i]);
+    }
+}
+collect(document);
+window.__likesMediaObserver = new MutationObserver(function (mutations) {
+    for (var i = 0; i < mutations.length; i++) {
+        var mutation = mutations[i];
+        if (mutation.type === 'attributes') {
+            collect(mutation.target);
+            continue;
+        }
+        for (var j = 0; j < mutation.addedNodes.length; j++) {
+            if (mutation.addedNodes[j].nodeType === 1) collect(mutation.addedNodes[j]);
+        }
+    }
+});
+window.__likesMediaObserver.observe(document.body, {
+    childList: true, subtree: true, attributes: true, attributeFilter: ['src', 'poster', 'style']
+});
+return true;
+"""
+
+MEDIA_DRAIN_SCRIPT = """
+if (!window.__likesMediaObserver) return null;
+var buffer = window.__likesMediaBuffer;
+window.__likesMediaBuffer = [];
+return JSON.stringify(buffer);
+"""
+
+BACKGROUND_URL_PATTERN = re.compile(r'url\("?(.*?)"?\)')
+FORMAT_PARAM_PATTERN = re.compile(r'format=\w+')
+NAME_PARAM_PATTERN = re.compile(r'name=\w+')
+# Collector records that stand in for a tweet's video
+VIDEO_RECORD_KINDS = ('video', 'poster', 'thumb')
+
+def upgrade_media_url(src):
+    """Rewrite a pbs.twimg.com/media URL so it requests the original-size JPEG"""
+    if 'format=' in src:
+        src = FORMAT_PARAM_PATTERN.sub('format=jpg', src)
+    if 'name=' in src:
+        src = NAME_PARAM_PATTERN.sub('name=orig', src)
+    else:
+        src += ('&' if '?' in src else '?') + 'name=orig'
+    return src
+
+def process_media_records(records):
+    """
+    Apply the URL filtering and quality upgrades to raw collector records.
+    Returns the media URLs in the order they were first seen on the page.
+    """
+    media_urls = {}
+
+    for kind, value, width, _tweet_id in records:
+        # blob: sources belong to the page's media player and cannot be downloaded
+        if not value or value.startswith('blob:'):
+            continue
+
+        # Resolved videos, video sources, posters and thumbnails are kept as-is
+        if kind == 'resolved' or kind in VIDEO_RECORD_KINDS:
+            media_urls[value] = None
+            continue
+
+        src = value
+        if kind == 'background':
+            match = BACKGROUND_URL_PATTERN.search(value)
+            if not match:
+                continue
+            src = match.group(1)
+
+        if not src:
+            continue
+        parsed = parse_media_url(src)
+        if not parsed.downloadable:
+            continue
+
+        # Skip tiny icons picked up by the generic image selector
+        if kind == 'image' and width and int(width) < 50:
+            continue
+
+        if parsed.kind == 'media':
+            media_urls[parsed.url] = None
+
+    return list(media_urls)
+
+def extract_media_records(driver):
+    """Collect raw media records from the loaded page with a single script call"""
+    payload = driver.execute_script(MEDIA_EXTRACTION_SCRIPT)
+    records = json.loads(payload) if payload else []
+    if _session_recorder is not None:
+        _session_recorder.record_scan(records)
+    return records
+
+def extract_media_from_page(driver, resolver=None):
+    """
+    A comprehensive function to extract all media from the currently loaded page.
+    """
     # First look for all possible media element types
     print("Scanning page for media content...")
+    metrics = get_metrics()
 
-    # 1. Check for images in media containers
-    media_images = driver.find_elements(By.CSS_SELECTOR, "div[data-testid='tweetPhoto'] img")
-    for img in media_images:
-        src = img.get_attribute('src')
-        if src and not is_profile_image(src):
-            # Convert to highest quality version
-            if '/media/' in src:
-                if 'format=' in src:
-                    src = re.sub(r'format=\w+', 'format=jpg', src)
-                if 'name=' in src:
-                    src = re.sub(r'name=\w+', 'name=orig', src)
-                else:
-                    src += '&name=orig'
-                media_urls.add(src)
+    with metrics.timer('extract_seconds'):
+        if not BATCHED_DOM_EXTRACTION:
+            media_urls = extract_media_from_page_webdriver(driver)
+        else:
+            records = extract_media_records(driver)
+            if resolver is not None:
+                records = resolve_video_records(records, resolver)
+            media_urls = process_media_records(records)
+
+    metrics.inc('extract_scans')
+    metrics.inc('extract_urls', len(media_urls))
+    return media_urls
+
+def install_media_observer(driver):
+    """Start the in-page MutationObserver; returns False if it was already running"""
+    return driver.execute_script(MEDIA_OBSERVER_SCRIPT)
+
+def drain_media_observer(driver):
+    """Pull the records buffered by the observer since the last drain"""
+    payload = driver.execute_script(MEDIA_DRAIN_SCRIPT)
+    if payload is None:
+        # The page was reloaded or navigated away, so the observer is gone
+        print("Media observer not running, installing it...")
+        install_media_observer(driver)
+        payload = driver.execute_script(MEDIA_DRAIN_SCRIPT)
+    records = json.loads(payload) if payload else []
+    if _session_recorder is not None:
+        _session_recorder.record_scan(records)
+    return records
+
+def harvest_new_media(driver, capture=None, resolver=None):
+    """
+    Return media found since the last tick. With a network capture the Likes
+    responses are parsed directly; in incremental mode only nodes added since the
+    previous drain are processed; otherwise the whole page is rescanned.
+    Video tweets are swapped for their real video files when a resolver is given.
+    """
+    if capture is not None:
+        return [item['url'] for item in capture.drain(driver)]
+    if not INCREMENTAL_HARVEST:
+        return extract_media_from_page(driver, resolver)
     
+    records = drain_media_observer(driver)
+    if resolver is not None:
+        records = resolve_video_records(records, resolver)
+    return process_media_records(records)
+
+def merge_media_urls(all_media_urls, media_urls, on_new_media=None, found=None):
+    """
+    Add media URLs to the collection (a dict of canonical key to URL) and
+    return how many were new. Other spellings of a known media item are ignored.
+    The optional found set collects the key of every media item seen, new or not.
+    """
+    new_count = 0
+    for media_url in media_urls:
+        parsed = parse_media_url(media_url)
+        if found is not None and parsed.downloadable:
+            found.add(parsed.key)
+        if parsed.key not in all_media_urls and parsed.downloadable:
+            all_media_urls[parsed.key] = media_url
+            new_count += 1
+            if on_new_media is not None:
+                on_new_media(media_url)
+    get_metrics().inc('media_found', new_count)
+    return new_count
+
+def extract_media_from_page_webdriver(driver):
+    """
+    Element-by-element extraction through WebDriver calls. Every find_elements and
+    get_attribute is its own round trip, so this is kept only as a fallback.
+    """
+    records = []
+
+    # 1. Check for images in media containers
+    for img in driver.find_elements(By.CSS_SELECTOR, "div[data-testid='tweetPhoto'] img"):
+        records.append(['photo', img.get_attribute('src'), None, None])
+
     # 2. Check for videos and their previews
-    video_elements = driver.find_elements(By.CSS_SELECTOR, "div[data-testid='videoPlayer'] video")
-    for video in video_elements:
-        src = video.get_attribute('src')
-        if src:
-            media_urls.add(src)
-        
+    for video in driver.find_elements(By.CSS_SELECTOR, "div[data-testid='videoPlayer'] video"):
+        records.append(['video', video.get_attribute('src'), None, None])
         # Also get the poster image as backup
-        poster = video.get_attribute('poster')
-        if poster:
-            media_urls.add(poster)
-    
+        records.append(['poster', video.get_attribute('poster'), None, None])
+
     # 3. Check for video thumbnails
-    video_thumbs = driver.find_elements(By.CSS_SELECTOR, "img[src*='ext_tw_video_thumb']")
-    for thumb in video_thumbs:
-        src = thumb.get_attribute('src')
-        if src:
-            media_urls.add(src)
-    
+    for thumb in driver.find_elements(By.CSS_SELECTOR, "img[src*='ext_tw_video_thumb']"):
+        records.append(['thumb', thumb.get_attribute('src'), None, None])
+
     # 4. Check for general media images with more generic selector
-    all_images = driver.find_elements(By.CSS_SELECTOR, "img[src*='pbs.twimg.com/media/']")
-    for img in all_images:
+    for img in driver.find_elements(By.CSS_SELECTOR, "img[src*='pbs.twimg.com/media/']"):
         src = img.get_attribute('src')
-        if src and not is_profile_image(src):
-            width = img.get_attribute('width')
-            # Skip tiny icons
-            if width and int(width) < 50:
-                continue
-                
-            if '/media/' in src:
-                if 'format=' in src:
-                    src = re.sub(r'format=\w+', 'format=jpg', src)
-                if 'name=' in src:
-                    src = re.sub(r'name=\w+', 'name=orig', src)
-                else:
-                    src += '&name=orig'
-                media_urls.add(src)
-    
+        width = img.get_attribute('width') if src and not is_profile_image(src) else None
+        records.append(['image', src, width, None])
+
     # 5. Background images in divs (sometimes contains media)
-    bg_elements = driver.find_elements(By.CSS_SELECTOR, "div[style*='background-image: url']")
-    for div in bg_elements:
-        style = div.get_attribute('style')
-        match = re.search(r'url\("?(.*?)"?\)', style)
-        if match:
-            src = match.group(1)
-            if src and not is_profile_image(src) and '/media/' in src:
-                if 'format=' in src:
-                    src = re.sub(r'format=\w+', 'format=jpg', src)
-                if 'name=' in src:
-                    src = re.sub(r'name=\w+', 'name=orig', src)
-                else:
-                    src += '&name=orig'
-                media_urls.add(src)
-    
+    for div in driver.find_elements(By.CSS_SELECTOR, "div[style*='background-image: url']"):
+        records.append(['background', div.get_attribute('style'), None, None])
+
     # 6. Check for Twitter card images (sometimes used for shared links with images)
-    card_images = driver.find_elements(By.CSS_SELECTOR, "div[data-testid='card.layoutSmall.media'] img, div[data-testid='card.layoutLarge.media'] img")
-    for img in card_images:
-        src = img.get_attribute('src')
-        if src and not is_profile_image(src):
-            if '/media/' in src:
-                if 'format=' in src:
-                    src = re.sub(r'format=\w+', 'format=jpg', src)
-                if 'name=' in src:
-                    src = re.sub(r'name=\w+', 'name=orig', src)
+    for img in driver.find_elements(By.CSS_SELECTOR, "div[data-testid='card.layoutSmall.media'] img, div[data-testid='card.layoutLarge.media'] img"):
+        records.append(['card', img.get_attribute('src'), None, None])
+
+    return process_media_records(records)
+
+# Likes timeline GraphQL endpoint fetched by the page as it scrolls
+LIKES_TIMELINE_URL_PATTERN = re.compile(r'/i/api/graphql/[^/?]+/Likes\b')
+
+def select_best_variant(variants):
+    """Pick the highest-bitrate MP4 from a video_info variant list"""
+    mp4_variants = [v for v in variants if v.get('content_type') == 'video/mp4' and v.get('url')]
+    if mp4_variants:
+        return max(mp4_variants, key=lambda v: v.get('bitrate', 0))['url']
+    # Fall back to whatever stream is offered (usually an HLS playlist)
+    for variant in variants:
+        if variant.get('url'):
+            return variant['url']
+    return None
+
+def media_url_from_entity(media):
+    """Return the full-resolution image or best video URL for a tweet media entity"""
+    if media.get('type') in ('video', 'animated_gif'):
+        return select_best_variant(media.get('video_info', {}).get('variants', []))
+
+    src = media.get('media_url_https')
+    if not src or is_profile_image(src):
+        return None
+    base, _, extension = src.rpartition('.')
+    return upgrade_media_url(f"{base}?format={extension}")
+
+def parse_likes_timeline_response(payload):
+    """
+    Parse a Likes timeline GraphQL response (a JSON string or decoded dict).
+    Returns (media, bottom_cursor) where media is a list of dicts with
+    tweet_id, media_key, type and url, in timeline order.
+    """
+    if isinstance(payload, (str, bytes)):
+        payload = json.loads(payload)
+
+    media_items = []
+    seen_keys = set()
+    bottom_cursor = None
+    stack = [payload]
+
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+
+        if node.get('cursorType') == 'Bottom' and node.get('value'):
+            bottom_cursor = node['value']
+
+        legacy = node.get('legacy')
+        if isinstance(legacy, dict) and 'extended_entities' in legacy:
+            tweet_id = node.get('rest_id') or legacy.get('id_str')
+            for media in legacy['extended_entities'].get('media', []):
+                media_key = media.get('media_key') or media.get('id_str')
+                url = media_url_from_entity(media)
+                if not url or media_key in seen_keys:
+                    continue
+                seen_keys.add(media_key)
+                media_items.append({
+                    'tweet_id': tweet_id,
+                    'media_key': media_key,
+                    'type': media.get('type'),
+                    'url': url
+                })
+
+        # Walk children in document order (quoted tweets carry their own media)
+        stack.extend(reversed(list(node.values())))
+
+    return media_items, bottom_cursor
+
+class LikesNetworkCapture:
+    """
+    Reads the Likes timeline responses the page has already fetched, using the
+    Chrome performance log and Network.getResponseBody, instead of scraping the DOM.
+    Requires the 'goog:loggingPrefs' performance capability on the driver.
+    """
+
+    def __init__(self):
+        self.pending_requests = {}
+        self.bottom_cursor = None
+        self.responses_read = 0
+
+    def drain(self, driver):
+        """Return media from Likes responses that finished loading since the last drain"""
+        media_items = []
+
+        for entry in driver.get_log('performance'):
+            message = json.loads(entry['message']).get('message', {})
+            method = message.get('method')
+            params = message.get('params', {})
+
+            if method == 'Network.responseReceived':
+                url = params.get('response', {}).get('url', '')
+                if LIKES_TIMELINE_URL_PATTERN.search(url):
+                    self.pending_requests[params['requestId']] = url
+            elif method == 'Network.loadingFinished' and params.get('requestId') in self.pending_requests:
+                request_id = params['requestId']
+                del self.pending_requests[request_id]
+                body = self.read_response_body(driver, request_id)
+                if body is None:
+                    continue
+                if _session_recorder is not None:
+                    _session_recorder.record_response(body)
+
+                items, cursor = parse_likes_timeline_response(body)
+                media_items.extend(items)
+                if cursor:
+                    self.bottom_cursor = cursor
+                self.responses_read += 1
+
+        return media_items
+
+    def read_response_body(self, driver, request_id):
+        """Fetch a response body through the DevTools protocol"""
+        try:
+            response = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+        except Exception as e:
+            print(f"Could not read Likes response {request_id}: {e}")
+            return None
+
+        body = response.get('body', '')
+        if response.get('base64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        return body
+
+# Public embed endpoint that returns a tweet's media, including video variants
+SYNDICATION_TWEET_URL = "https://cdn.syndication.twimg.com/tweet-result"
+RADIX36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def js_number_to_base36(value):
+    """Port of V8's Number.prototype.toString(36) for positive doubles"""
+    integer = math.floor(value)
+    fraction = value - integer
+    delta = max(math.nextafter(0.0, 1.0), 0.5 * (math.nextafter(value, math.inf) - value))
+    fraction_digits = []
+
+    if fraction >= delta:
+        while True:
+            fraction *= 36
+            delta *= 36
+            digit = int(fraction)
+            fraction_digits.append(digit)
+            fraction -= digit
+            if (fraction > 0.5 or (fraction == 0.5 and digit & 1)) and fraction + delta > 1:
+                # Round up, carrying into the integer part if every digit overflows
+                while fraction_digits and fraction_digits[-1] + 1 >= 36:
+                    fraction_digits.pop()
+                if fraction_digits:
+                    fraction_digits[-1] += 1
                 else:
-                    src += '&name=orig'
-                media_urls.add(src)
+                    integer += 1
+                break
+            if fraction < delta:
+                break
+
+    integer_digits = ''
+    while True:
+        integer, remainder = divmod(int(integer), 36)
+        integer_digits = RADIX36_DIGITS[remainder] + integer_digits
+        if integer == 0:
+            break
+
+    if not fraction_digits:
+        return integer_digits
+    return integer_digits + '.' + ''.join(RADIX36_DIGITS[d] for d in fraction_digits)
+
+def syndication_token(tweet_id):
+    """Token the embed endpoint expects: ((id / 1e15) * PI).toString(36) without zeros and dots"""
+    return re.sub(r'(0+|\.)', '', js_number_to_base36(int(tweet_id) / 1e15 * math.pi))
+
+class VideoResolver:
+    """
+    Maps video tweets to their highest-bitrate MP4 (or HLS playlist when no MP4
+    is offered) through the public embed endpoint. Results are cached per tweet
+    so every tweet costs at most one request.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': DOWNLOAD_HEADERS['User-Agent']})
+
+    def resolve(self, tweet_id):
+        """Return the best video URLs for a tweet (empty if it has none or the lookup failed)"""
+        if tweet_id in self.cache:
+            return self.cache[tweet_id]
+
+        video_urls = []
+        try:
+            response = self.session.get(SYNDICATION_TWEET_URL, timeout=15,
+                                        params={'id': tweet_id, 'token': syndication_token(tweet_id)})
+            response.raise_for_status()
+            for media in response.json().get('mediaDetails', []):
+                if media.get('type') in ('video', 'animated_gif'):
+                    url = select_best_variant(media.get('video_info', {}).get('variants', []))
+                    if url:
+                        video_urls.append(url)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Could not resolve video for tweet {tweet_id}: {e}")
+
+        self.cache[tweet_id] = video_urls
+        if _session_recorder is not None:
+            _session_recorder.record_videos(tweet_id, video_urls)
+        return video_urls
+
+def resolve_video_records(records, resolver):
+    """
+    Replace video sources, posters and thumbnails with the tweet's real video
+    files. Tweets whose video cannot be resolved keep their poster records.
+    """
+    video_tweets = []
+    for kind, _value, _width, tweet_id in records:
+        if kind in VIDEO_RECORD_KINDS and tweet_id and tweet_id not in video_tweets:
+            video_tweets.append(tweet_id)
+
+    resolved = {}
+    for tweet_id in video_tweets:
+        video_urls = resolver.resolve(tweet_id)
+        if video_urls:
+            resolved[tweet_id] = video_urls
+
+    if not resolved:
+        return records
+
+    kept = [record for record in records
+            if not (record[0] in VIDEO_RECORD_KINDS and record[3] in resolved)]
+    for tweet_id, video_urls in resolved.items():
+        kept.extend(['resolved', url, None, tweet_id] for url in video_urls)
+    return kept
+
+class SessionRecorder:
+    """
+    Writes what the browser handed to the Python side during a scroll session
+    to a gzip-compressed JSON lines archive: collector records for each DOM
+    scan, raw Likes responses in network mode, and video lookups. Replaying
+    the archive reruns every extraction rule without a browser or network.
+    """
+
+    def __init__(self, path, capture_mode=CAPTURE_MODE):
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.events = 0
+        self._write('session', capture_mode=capture_mode, started=datetime.now().isoformat())
+
+    def _write(self, event_type, **fields):
+        # The type always comes first so replay can pick out events without parsing them
+        line = json.dumps({'type': event_type, **fields})
+        with self.lock:
+            self.file.write(line + '\n')
+            self.events += 1
+
+    def record_scan(self, records):
+        if records:
+            self._write('records', records=records)
+
+    def record_response(self, body):
+        self._write('response', body=body)
+
+    def record_videos(self, tweet_id, video_urls):
+        self._write('videos', tweet_id=tweet_id, urls=video_urls)
+
+    def record_result(self, media_urls):
+        """Store the media the live run collected, so a replay can be diffed against it"""
+        self._write('result', media_urls=list(media_urls))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+_session_recorder = None
+
+def start_session_recording(path):
+    global _session_recorder
+    _session_recorder = SessionRecorder(path)
+    print(f"Recording session to {path}")
+    return _session_recorder
+
+def stop_session_recording():
+    global _session_recorder
+    if _session_recorder is not None:
+        _session_recorder.close()
+        print(f"Recorded {_session_recorder.events} events to {_session_recorder.path}")
+        _session_recorder = None
+
+class ArchivedVideoResolver:
+    """Answers video lookups from a recorded session instead of the embed endpoint"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def resolve(self, tweet_id):
+        return self.cache.get(tweet_id, [])
+
+def replay_chunk(lines, video_cache):
+    """
+    Run the extraction rules over a slice of archive lines and return the media
+    URLs found, in order. Runs in a worker process, so it must stay module-level.
+    """
+    resolver = ArchivedVideoResolver(video_cache) if video_cache else None
+    media_urls = []
+    for line in lines:
+        event = json.loads(line)
+        if event['type'] == 'records':
+            records = event['records']
+            if resolver is not None:
+                records = resolve_video_records(records, resolver)
+            media_urls.extend(process_media_records(records))
+        elif event['type'] == 'response':
+            media_items, _ = parse_likes_timeline_response(event['body'])
+            media_urls.extend(item['url'] for item in media_items)
+    return media_urls
+
+def replay_session(archive_path, processes=REPLAY_PROCESSES, chunk_size=REPLAY_CHUNK_SIZE):
+    """
+    Re-extract media from a recorded session archive without a browser. Scans
+    are processed in chunks on a process pool and merged in recording order,
+    exactly as the scroll loop merges them. Returns (media URLs, URLs the live
+    run collected or None if the recording has no result).
+    """
+    video_cache = {}
+    recorded_result = None
+    scan_lines = []
+    with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('{"type": "videos"'):
+                event = json.loads(line)
+                video_cache[event['tweet_id']] = event['urls']
+            elif line.startswith('{"type": "result"'):
+                recorded_result = json.loads(line)['media_urls']
+            elif line.startswith(('{"type": "records"', '{"type": "response"')):
+                scan_lines.append(line)
     
-    return list(media_urls)
+    # Without RESOLVE_VIDEOS the live run kept posters and thumbnails; replay does the same
+    if not RESOLVE_VIDEOS:
+        video_cache = {}
+    
+    chunks = [scan_lines[i:i + chunk_size] for i in range(0, len(scan_lines), chunk_size)]
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(replay_chunk, chunks, [video_cache] * len(chunks)))
+    else:
+        results = [replay_chunk(chunk, video_cache) for chunk in chunks]
+    
+    all_media_urls = {}
+    for media_urls in results:
+        merge_media_urls(all_media_urls, media_urls)
+    print(f"Replayed {len(scan_lines)} scans from {archive_path} on {len(chunks)} chunks")
+    return list(all_media_urls.values()), recorded_result
+
+def replay_main(archive_path, output_path=None, processes=REPLAY_PROCESSES):
+    """Replay a recorded session, report how it differs from the live run and optionally save the URLs"""
+    start = time.time()
+    media_urls, recorded_result = replay_session(archive_path, processes)
+    print(f"Found {len(media_urls)} media URLs in {time.time() - start:.2f}s")
+    
+    if recorded_result is not None:
+        replayed = {canonical_media_key(url) for url in media_urls}
+        recorded = {canonical_media_key(url) for url in recorded_result}
+        print(f"Live run collected {len(recorded)}: {len(replayed - recorded)} new, {len(recorded - replayed)} no longer found")
+        for key in sorted(replayed - recorded)[:20]:
+            print(f"  + {key}")
+        for key in sorted(recorded - replayed)[:20]:
+            print(f"  - {key}")
+    
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(media_urls) + '\n')
+        print(f"Media URLs written to {output_path}")
+    return media_urls
 
 def login_to_x(driver, username, password):
-    """Log into X/Twitter account"""
+    """Log into X/Twitter account; returns True once logged in"""
     print("Logging into X/Twitter...")
     driver.get("https://x.com/login")
     wait = WebDriverWait(driver, 20)
@@ -155,32 +1085,111 @@ def login_to_x(driver, username, password):
         username_field = wait.until(EC.presence_of_element_located((By.NAME, "text")))
         username_field.send_keys(username)
         username_field.send_keys(Keys.RETURN)
-        time.sleep(2)
         
-        # Handle potential phone verification step
-        try:
-            # Check if there's a "phone" input (means verification needed)
-            WebDriverWait(driver, 3).until(EC.presence_of_element_located((By.NAME, "phone")))
+        # The next step is either the password or a phone verification
+        next_field = wait.until(EC.any_of(
+            EC.presence_of_element_located((By.NAME, "password")),
+            EC.presence_of_element_located((By.NAME, "phone"))))
+        if next_field.get_attribute("name") == "phone":
             print("Phone verification required. Please complete verification manually...")
             # Wait longer for manual intervention
             WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.NAME, "password")))
-        except:
-            # Phone verification not needed, continue
-            pass
             
         password_field = wait.until(EC.presence_of_element_located((By.NAME, "password")))
         password_field.send_keys(password)
         password_field.send_keys(Keys.RETURN)
         
-        # Wait for navigation to complete (look for main nav element)
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "nav")))
+        # Wait for navigation to complete (look for the logged-in navigation)
+        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, LOGGED_IN_SELECTOR)))
         print("Login successful!")
+        return True
         
     except Exception as e:
         print(f"Login error: {e}")
         print("Please check your credentials or try logging in manually...")
-        # Wait for manual login (give user 60 seconds to intervene)
-        time.sleep(60)
+        # Wait for manual login (give user 60 seconds to intervene), continuing as soon as it succeeds
+        try:
+            WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.CSS_SELECTOR, LOGGED_IN_SELECTOR)))
+            print("Login successful!")
+            return True
+        except Exception:
+            return False
+
+def save_session(driver):
+    """Store the session cookies (readable only by this user) for the next run"""
+    cookies = driver.get_cookies()
+    os.makedirs(os.path.dirname(SESSION_COOKIES_FILE), exist_ok=True)
+    temp_path = SESSION_COOKIES_FILE + '.tmp'
+    with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(cookies, f)
+    os.replace(temp_path, SESSION_COOKIES_FILE)
+    print(f"Saved {len(cookies)} session cookies")
+
+def restore_session(driver):
+    """
+    Load the cookies saved by an earlier run and check that they are still
+    logged in. Returns False (and the caller logs in) when there are none or
+    the session has expired.
+    """
+    if not os.path.exists(SESSION_COOKIES_FILE):
+        return False
+    try:
+        with open(SESSION_COOKIES_FILE, 'r') as f:
+            cookies = json.load(f)
+    except Exception as e:
+        print(f"Error loading saved session: {e}")
+        return False
+    if not any(cookie.get('name') == 'auth_token' for cookie in cookies):
+        return False
+    
+    print("Restoring saved session...")
+    # Cookies can only be set for the site currently loaded; robots.txt is the cheapest page
+    driver.get("https://x.com/robots.txt")
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception:
+            pass
+    
+    driver.get("https://x.com/home")
+    try:
+        WebDriverWait(driver, SESSION_CHECK_TIMEOUT).until(
+            lambda d: '/login' in d.current_url or '/i/flow/' in d.current_url
+            or d.find_elements(By.CSS_SELECTOR, LOGGED_IN_SELECTOR))
+    except Exception:
+        pass
+    if driver.find_elements(By.CSS_SELECTOR, LOGGED_IN_SELECTOR):
+        print("Saved session is still valid, skipping login")
+        return True
+    print("Saved session has expired, logging in again")
+    driver.delete_all_cookies()
+    return False
+
+def launch_chrome(chrome_options):
+    """
+    Start Chrome with the chromedriver recorded by the last run, so startup
+    needs no network. A new driver is fetched only when there is none cached
+    or the cached one no longer matches the installed Chrome.
+    """
+    cached_path = None
+    if os.path.exists(DRIVER_CACHE_FILE):
+        try:
+            with open(DRIVER_CACHE_FILE, 'r') as f:
+                cached_path = json.load(f).get('chromedriver')
+        except Exception as e:
+            print(f"Error loading driver cache: {e}")
+    
+    if cached_path and os.path.exists(cached_path):
+        try:
+            return webdriver.Chrome(service=Service(cached_path), options=chrome_options)
+        except WebDriverException as e:
+            print(f"Cached chromedriver failed to start ({e.msg}), fetching a matching one...")
+    
+    driver_path = ChromeDriverManager().install()
+    os.makedirs(os.path.dirname(DRIVER_CACHE_FILE), exist_ok=True)
+    with open(DRIVER_CACHE_FILE, 'w') as f:
+        json.dump({'chromedriver': driver_path}, f)
+    return webdriver.Chrome(service=Service(driver_path), options=chrome_options)
 
 def navigate_to_likes(driver, profile_url, likes_tab_selector):
     """Navigate to the likes tab of the profile"""
@@ -200,55 +1209,670 @@ def navigate_to_likes(driver, profile_url, likes_tab_selector):
         likes_url = f"{profile_url}/likes"
         print(f"Attempting direct navigation to {likes_url}")
         driver.get(likes_url)
-        time.sleep(5)
+        try:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, TWEET_CONTAINER_SELECTOR)))
+        except Exception:
+            print("No tweets appeared on the likes page")
 
-def save_checkpoint(media_urls, downloaded_count, scroll_count):
-    """Save progress to checkpoint file"""
-    if not os.path.exists(DOWNLOAD_FOLDER):
-        os.makedirs(DOWNLOAD_FOLDER)
-        
-    checkpoint_data = {
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'media_urls': list(media_urls),
-        'downloaded_count': downloaded_count,
-        'scroll_count': scroll_count,
-        'total_found': len(media_urls)
-    }
-    
-    with open(CHECKPOINT_FILE, 'w') as f:
-        json.dump(checkpoint_data, f)
+class ProgressJournal:
+    """
+    Append-only JSONL store of discovered media and their download status, keyed
+    by canonical media key. Each line is one record and state is rebuilt by
+    replaying the lines in order, so the order media were found in (and with it
+    each file's index) is the same in every run. Writes are fsynced in batches,
+    and the file is periodically rewritten as a compact snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.meta = {'scroll_count': 0}
+        self.done_count = 0
+        self.record_count = 0
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.file = None
+        self.torn_tail = False
+        self.load()
+
+    def load(self):
+        """Replay the journal, skipping a torn final line left by a crash"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self.torn_tail = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.apply(record)
+                self.record_count += 1
+
+    def apply(self, record):
+        if 'meta' in record:
+            self.meta.update(record['meta'])
+            return
+
+        key = record.get('key') or canonical_media_key(record['url'])
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {'url': record.get('url'), 'status': 'pending',
+                                         'path': None, 'position': len(self.entries)}
+        if record.get('url') and not entry['url']:
+            entry['url'] = record['url']
+        if 'path' in record:
+            entry['path'] = record['path']
+        if 'status' in record:
+            self.done_count += (record['status'] == 'done') - (entry['status'] == 'done')
+            entry['status'] = record['status']
+
+    def append(self, records):
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8')
+                if self.torn_tail:
+                    # Terminate a partial line so it cannot swallow the next record
+                    self.file.write('\n')
+                    self.torn_tail = False
+            for record in records:
+                self.apply(record)
+                self.file.write(json.dumps(record) + '\n')
+            self.record_count += len(records)
+            self.unsynced += len(records)
+
+            if self.unsynced >= JOURNAL_FSYNC_EVERY or time.time() - self.last_sync >= JOURNAL_FSYNC_INTERVAL:
+                self.sync()
+            if self.record_count > max(JOURNAL_COMPACT_MIN_RECORDS, JOURNAL_COMPACT_RATIO * len(self.entries)):
+                self.compact()
+
+    def add_urls(self, media_urls):
+        """Record media whose key has not been seen before, in discovery order"""
+        with self.lock:
+            records = []
+            new_keys = set()
+            for url in media_urls:
+                key = canonical_media_key(url)
+                if key not in self.entries and key not in new_keys:
+                    new_keys.add(key)
+                    records.append({'key': key, 'url': url})
+            if records:
+                self.append(records)
+
+    def set_status(self, key, status, path=None):
+        """Record the download status ('pending', 'done' or 'failed') of a media key"""
+        record = {'key': key, 'status': status}
+        if path:
+            record['path'] = path
+        self.append([record])
+
+    def set_meta(self, **fields):
+        """Record run counters such as scroll_count"""
+        with self.lock:
+            changed = {key: value for key, value in fields.items() if self.meta.get(key) != value}
+            if changed:
+                self.append([{'meta': changed}])
+
+    def position(self, key):
+        """Stable discovery index of a media key"""
+        return self.entries[key]['position']
+
+    def is_downloaded(self, key):
+        """True if the media is recorded as done and its file is still on disk"""
+        entry = self.entries.get(key)
+        if entry is None or entry['status'] != 'done':
+            return False
+        return entry['path'] is None or os.path.exists(entry['path'])
+
+    def remaining_urls(self):
+        """URLs still to fetch: pending, failed, or done but missing from disk"""
+        with self.lock:
+            return [entry['url'] for key, entry in self.entries.items()
+                    if entry['url'] and not self.is_downloaded(key)]
+
+    def sync(self):
+        """Flush buffered records to disk"""
+        with self.lock:
+            if self.file is not None:
+                with get_metrics().timer('journal_fsync_seconds'):
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.last_sync = time.time()
+
+    def compact(self):
+        """Rewrite the journal as one record per media key, replacing it atomically"""
+        with self.lock:
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'meta': self.meta}) + '\n')
+                for key, entry in self.entries.items():
+                    record = {'key': key, 'url': entry['url'], 'status': entry['status']}
+                    if entry['path']:
+                        record['path'] = entry['path']
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            os.replace(temp_path, self.path)
+            self.record_count = len(self.entries) + 1
+            self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    """Open the progress journal once per run, migrating an old checkpoint.json if present"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            migrate = not os.path.exists(JOURNAL_FILE) and os.path.exists(CHECKPOINT_FILE)
+            _journal = ProgressJournal(JOURNAL_FILE)
+            if migrate:
+                try:
+                    with open(CHECKPOINT_FILE, 'r') as f:
+                        checkpoint_data = json.load(f)
+                    # The old positional download count cannot be trusted, so every
+                    # URL starts as pending; files already on disk are skipped later
+                    _journal.add_urls(checkpoint_data.get('media_urls', []))
+                    _journal.set_meta(scroll_count=checkpoint_data.get('scroll_count', 0))
+                    _journal.compact()
+                    print(f"Migrated {CHECKPOINT_FILE} to {JOURNAL_FILE}")
+                except Exception as e:
+                    print(f"Error migrating checkpoint: {e}")
+        return _journal
+
+def save_checkpoint(media_urls, scroll_count):
+    """Append newly found media and the scroll position to the progress journal"""
+    journal = get_journal()
+    metrics = get_metrics()
+    with metrics.timer('checkpoint_seconds'):
+        journal.add_urls(media_urls)
+        journal.set_meta(scroll_count=scroll_count, timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        journal.sync()
+    metrics.inc('checkpoints')
+    metrics.log('checkpoint', media=len(journal.entries), downloaded=journal.done_count, scroll_count=scroll_count)
     
-    print(f"Progress saved: {len(media_urls)} media URLs found, {downloaded_count} downloaded")
+    print(f"Progress saved: {len(journal.entries)} media items found, {journal.done_count} downloaded")
+
+def record_download(url, result):
+    """Record the outcome of a single download (result is None on failure)"""
+    journal = get_journal()
+    metrics = get_metrics()
+    key = canonical_media_key(url)
+    if result:
+        file_size, file_path, sha256 = result
+        journal.set_status(key, 'done', file_path)
+        get_media_index().add(key, file_path, sha256=sha256, size=file_size)
+        metrics.inc('downloads_completed')
+        metrics.log('download', key=key, url=url, status='done', bytes=file_size, path=file_path)
+    else:
+        journal.set_status(key, 'failed')
+        metrics.inc('downloads_failed')
+        metrics.log('download', key=key, url=url, status='failed')
+
+# Files saved by download_media are named '{index}_{media id}_{filename}'
+INDEXED_FILENAME_PATTERN = re.compile(r'^\d+_(.+)\.(\w+)$')
+VIDEO_EXTENSIONS = ('mp4', 'webm', 'mov', 'ts')
+
+def media_key_from_filename(name):
+    """Recover the canonical media key from a downloaded file's name, or None"""
+    match = INDEXED_FILENAME_PATTERN.match(name)
+    if not match:
+        return None
+    stem, extension = match.groups()
+
+    # Photos and GIF videos repeat their ID: '<id>_<id>.jpg'
+    half = len(stem) // 2
+    if len(stem) % 2 == 1 and stem[half] == '_' and stem[:half] == stem[half + 1:]:
+        token = stem[:half]
+        return f"video:{token}" if extension in VIDEO_EXTENSIONS else f"media:{token}"
+
+    # Videos and their thumbnails lead with the numeric video ID
+    numeric = re.match(r'(\d+)_', stem)
+    if not numeric:
+        return None
+    token = numeric.group(1)
+    return f"video:{token}" if extension in VIDEO_EXTENSIONS else f"thumb:{token}"
+
+def legacy_filename_keys(urls):
+    """
+    Map URL basenames to media keys for files saved before IDs were part of
+    the name ('{index}_{basename}'), such as videos and their thumbnails
+    """
+    keys = {}
+    for url in urls:
+        name = os.path.basename(urllib.parse.urlparse(url).path)
+        if name:
+            keys[name] = canonical_media_key(url)
+    return keys
+
+def legacy_media_key(name, legacy_keys):
+    """Look up an old '{index}_{basename}' file in legacy_filename_keys(), or None"""
+    match = INDEXED_FILENAME_PATTERN.match(name)
+    if not match:
+        return None
+    rest = name.split('_', 1)[1]
+    # The old code appended an extension when the URL path had none
+    return legacy_keys.get(rest) or legacy_keys.get(rest.rpartition('.')[0])
+
+class MediaIndex:
+    """
+    Persistent map of media key to downloaded file, relative to the download
+    folder. Built once by scanning the batch folders, then extended by one
+    appended line per finished download, so already-downloaded media can be
+    skipped without any network request. Each line is the full current record
+    for its key; content hashes ride along so dedup never rereads a file twice.
+    known_urls lets the first scan recognise files named without a media ID.
+    """
+
+    def __init__(self, path, download_folder, known_urls=()):
+        self.path = path
+        self.download_folder = download_folder
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.details = {}
+        self.file = None
+        if os.path.exists(path):
+            self.load()
+        else:
+            self.rebuild(known_urls)
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                key = record.pop('key')
+                self.paths[key] = record.pop('path')
+                self.details[key] = record
+
+    def rebuild(self, known_urls=()):
+        """Scan the batch folders once and write a fresh index"""
+        print(f"Building media index from {self.download_folder}...")
+        self.paths = {}
+        self.details = {}
+        legacy_keys = legacy_filename_keys(known_urls)
+        if os.path.isdir(self.download_folder):
+            for folder in os.scandir(self.download_folder):
+                if not folder.is_dir() or not folder.name.startswith('batch_'):
+                    continue
+                for entry in os.scandir(folder.path):
+                    key = media_key_from_filename(entry.name) or legacy_media_key(entry.name, legacy_keys)
+                    if key and entry.is_file():
+                        self.paths[key] = os.path.join(folder.name, entry.name)
+
+        self.compact()
+        print(f"Indexed {len(self.paths)} existing media files")
+
+    def compact(self):
+        """Rewrite the index with one line per key"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for key, path in self.paths.items():
+                    record = {'key': key, 'path': path}
+                    record.update(self.details.get(key, {}))
+                    f.write(json.dumps(record) + '\n')
+            os.replace(temp_path, self.path)
+
+    def add(self, key, full_path, **details):
+        """Record a finished download along with its sha256, size, ..."""
+        path = os.path.relpath(full_path, self.download_folder)
+        with self.lock:
+            self.paths[key] = path
+            self.details[key] = details
+            self._write(key)
+
+    def update(self, key, **details):
+        """Attach more details (hashes) to an indexed file"""
+        with self.lock:
+            self.details.setdefault(key, {}).update(details)
+            self._write(key)
+
+    def _write(self, key):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        record = {'key': key, 'path': self.paths[key]}
+        record.update(self.details.get(key, {}))
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def find(self, key):
+        """Return the full path of an already-downloaded media file, or None"""
+        path = self.paths.get(key)
+        if path is None:
+            return None
+        full_path = os.path.join(self.download_folder, path)
+        return full_path if os.path.exists(full_path) else None
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+_media_index = None
+_media_index_lock = threading.Lock()
+
+def get_media_index():
+    """Open the media index once per run, scanning DOWNLOAD_FOLDER the first time"""
+    global _media_index
+    with _media_index_lock:
+        if _media_index is None:
+            # Opening the journal first migrates checkpoint.json, whose URLs
+            # identify old files named without a media ID
+            known_urls = [entry['url'] for entry in get_journal().entries.values() if entry['url']]
+            _media_index = MediaIndex(MEDIA_INDEX_FILE, DOWNLOAD_FOLDER, known_urls)
+        return _media_index
+
+def is_media_downloaded(key):
+    """Check the media index and journal before spending a request on a media key"""
+    journal = get_journal()
+    if journal.is_downloaded(key):
+        return True
+    existing_path = get_media_index().find(key)
+    if existing_path is None:
+        return False
+    # Found on disk from an earlier run; bring the journal up to date
+    if key in journal.entries:
+        journal.set_status(key, 'done', existing_path)
+    return True
 
 def load_checkpoint():
-    """Load progress from checkpoint file if it exists"""
-    if os.path.exists(CHECKPOINT_FILE):
-        try:
-            with open(CHECKPOINT_FILE, 'r') as f:
-                checkpoint_data = json.load(f)
-            
-            # Convert back to set for easy deduplication
-            media_urls = set(checkpoint_data.get('media_urls', []))
-            downloaded_count = checkpoint_data.get('downloaded_count', 0)
-            scroll_count = checkpoint_data.get('scroll_count', 0)
-            
+    """Load progress from the journal if it exists"""
+    try:
+        journal = get_journal()
+        
+        # Convert back to set for easy deduplication
+        media_urls = set(entry['url'] for entry in journal.entries.values() if entry['url'])
+        downloaded_count = journal.done_count
+        scroll_count = journal.meta.get('scroll_count', 0)
+        
+        if media_urls:
             print(f"Checkpoint loaded: {len(media_urls)} media URLs found, {downloaded_count} downloaded")
-            return media_urls, downloaded_count, scroll_count
-        except Exception as e:
-            print(f"Error loading checkpoint: {e}")
+        return media_urls, downloaded_count, scroll_count
+    except Exception as e:
+        print(f"Error loading checkpoint: {e}")
     
     # Return defaults if no checkpoint or error
     return set(), 0, 0
 
-def optimized_scroll_for_media(driver, target_count=TARGET_MEDIA_COUNT):
+# Page activity probe used by the adaptive scroll wait. The first call wraps
+# fetch/XMLHttpRequest to count in-flight requests; every call returns
+# [scrollHeight, newly seen tweet articles, pending requests, requests started, near bottom].
+PAGE_ACTIVITY_SCRIPT = r"""
+if (!window.__likesRequestTracker) {
+    window.__likesRequestTracker = {pending: 0, started: 0};
+    var tracker = window.__likesRequestTracker;
+    var originalFetch = window.fetch;
+    window.fetch = function () {
+        tracker.pending++;
+        tracker.started++;
+        return originalFetch.apply(this, arguments).finally(function () { tracker.pending--; });
+    };
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        tracker.pending++;
+        tracker.started++;
+        this.addEventListener('loadend', function () { tracker.pending--; });
+        return originalSend.apply(this, arguments);
+    };
+}
+var fresh = document.querySelectorAll("article[data-testid='tweet']:not([data-likes-seen])");
+for (var i = 0; i < fresh.length; i++) fresh[i].setAttribute('data-likes-seen', '1');
+var nearBottom = window.scrollY + 2 * window.innerHeight >= document.body.scrollHeight;
+return [document.body.scrollHeight, fresh.length, window.__likesRequestTracker.pending,
+        window.__likesRequestTracker.started, nearBottom];
+"""
+
+def read_page_activity(driver):
+    """Snapshot of page height, new tweet articles and in-flight requests"""
+    return driver.execute_script(PAGE_ACTIVITY_SCRIPT)
+
+def new_scroll_pacing():
+    """State for adaptive scroll waits: idle streak and observed latencies by outcome"""
+    return {'idle_scrolls': 0, 'waits': {'content': [], 'network': [], 'in-view': [], 'timeout': []}}
+
+def wait_for_new_content(driver, baseline, pacing, max_wait=None):
+    """
+    Wait after a scroll until the page grows, new tweet articles appear or the
+    requests it triggered settle. While such a request is in flight it waits up to
+    SCROLL_MAX_WAIT; only when nothing happens does it stop at the backoff cap,
+    which doubles with each consecutive idle scroll.
+    """
+    if max_wait is None:
+        max_wait = min(SCROLL_MAX_WAIT, SCROLL_MIN_WAIT * 2 ** pacing['idle_scrolls'])
+
+    if not ADAPTIVE_SCROLL_WAIT:
+        time.sleep(max_wait)
+        get_metrics().observe('scroll_wait_seconds', max_wait)
+        return max_wait
+
+    start = time.time()
+    quiet_since = None
+    outcome = 'timeout'
+
+    while True:
+        time.sleep(SCROLL_POLL_INTERVAL)
+        elapsed = time.time() - start
+        height, new_articles, pending, started, near_bottom = read_page_activity(driver)
+
+        if height > baseline[0] or new_articles > 0:
+            outcome = 'content'
+            break
+
+        if pending == 0 and started > baseline[3]:
+            # Requests fired by the scroll have finished; give rendering a short quiet period
+            quiet_since = quiet_since or time.time()
+            if time.time() - quiet_since >= NETWORK_IDLE_TIME:
+                outcome = 'network'
+                break
+        elif pending == 0 and not near_bottom and elapsed >= SCROLL_MIN_WAIT:
+            # Already-loaded tweets scrolled into view; nothing further to fetch
+            outcome = 'in-view'
+            break
+        else:
+            quiet_since = None
+
+        # The backoff cap is for scrolls that triggered nothing; a timeline request
+        # started by this scroll may take up to SCROLL_MAX_WAIT to load and settle
+        if pending > 0 or started > baseline[3]:
+            deadline = max(max_wait, SCROLL_MAX_WAIT)
+        else:
+            deadline = max_wait
+        if elapsed >= deadline:
+            break
+
+    elapsed = time.time() - start
+    pacing['waits'][outcome].append(elapsed)
+    get_metrics().observe('scroll_wait_seconds', elapsed)
+    get_metrics().inc(f"scroll_waits_{outcome.replace('-', '_')}")
+    pacing['idle_scrolls'] = pacing['idle_scrolls'] + 1 if outcome == 'timeout' else 0
+    return elapsed
+
+def report_scroll_latency(pacing):
+    """Print load-latency statistics per wait outcome to help tune the limits"""
+    for outcome, waits in pacing['waits'].items():
+        if not waits:
+            continue
+        ordered = sorted(waits)
+        p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+        print(f"Scroll wait [{outcome}]: {len(waits)} scrolls, "
+              f"median {statistics.median(ordered):.2f}s, p90 {p90:.2f}s, max {ordered[-1]:.2f}s")
+
+BROWSER_METRICS_SCRIPT = r"""
+var memory = performance.memory;
+return [memory ? memory.usedJSHeapSize : null, document.getElementsByTagName('*').length,
+        document.querySelectorAll("article[data-testid='tweet']").length];
+"""
+
+# Releases the media of harvested tweets more than arguments[0] screens above the
+# viewport: images are pointed at a blank pixel, videos unloaded, background images
+# dropped, and the tweet is skipped by layout and paint at its old height. Only
+# attributes and inline styles change; the nodes React rendered stay in place, so
+# X can still update or unmount those tweets without React losing track of them.
+PRUNE_ARTICLES_SCRIPT = r"""
+var BLANK = 'data:image/gif;base64,R0lGODlhAQABAAAAACw=';
+var limit = -arguments[0] * window.innerHeight;
+var articles = document.querySelectorAll("article[data-testid='tweet']:not([data-likes-pruned])");
+var pruned = 0;
+for (var i = 0; i < articles.length; i++) {
+    var article = articles[i], rect = article.getBoundingClientRect();
+    if (rect.bottom >= limit) continue;
+    var images = article.querySelectorAll('img');
+    for (var j = 0; j < images.length; j++) {
+        images[j].removeAttribute('srcset');
+        images[j].src = BLANK;
+    }
+    var videos = article.querySelectorAll('video');
+    for (var j = 0; j < videos.length; j++) {
+        videos[j].pause();
+        videos[j].removeAttribute('src');
+        videos[j].removeAttribute('poster');
+        videos[j].load();
+    }
+    var backgrounds = article.querySelectorAll("[style*='background-image']");
+    for (var j = 0; j < backgrounds.length; j++) backgrounds[j].style.backgroundImage = 'none';
+    article.style.containIntrinsicHeight = rect.height + 'px';
+    article.style.contentVisibility = 'hidden';
+    article.setAttribute('data-likes-pruned', '1');
+    pruned++;
+}
+return pruned;
+"""
+
+def new_browser_stats():
+    """State for memory control: scan latencies, renderer samples and prunes"""
+    return {'scan_times': [], 'samples': [], 'pruned': 0}
+
+def sample_browser_metrics(driver, stats, scroll_count):
+    """Record JS heap size, DOM node count and tweet articles in the page"""
+    heap, nodes, articles = driver.execute_script(BROWSER_METRICS_SCRIPT)
+    stats['samples'].append((scroll_count, heap, nodes, articles))
+    metrics = get_metrics()
+    if heap:
+        metrics.set_gauge('browser_js_heap_bytes', heap)
+        metrics.set_gauge('browser_js_heap_peak_bytes', max(heap, metrics.gauges.get('browser_js_heap_peak_bytes', 0)))
+    metrics.set_gauge('browser_dom_nodes', nodes)
+    metrics.set_gauge('browser_tweet_articles', articles)
+    metrics.log('browser', scroll_count=scroll_count, heap_bytes=heap, dom_nodes=nodes, tweets=articles)
+    return heap, nodes, articles
+
+def control_browser_memory(driver, stats, scroll_count, mode=MEMORY_CONTROL):
+    """
+    Run every MEMORY_CONTROL_EVERY scrolls, after that tick's media have been
+    harvested: prune if enabled, then sample renderer metrics.
+    """
+    if scroll_count == 0 or scroll_count % MEMORY_CONTROL_EVERY != 0:
+        return
+    if mode == "prune":
+        pruned = driver.execute_script(PRUNE_ARTICLES_SCRIPT, PRUNE_MARGIN_SCREENS)
+        stats['pruned'] += pruned
+        get_metrics().inc('articles_pruned', pruned)
+    sample_browser_metrics(driver, stats, scroll_count)
+
+def report_browser_metrics(stats):
+    """Print renderer memory and how per-tick scan latency has developed"""
+    if stats['samples']:
+        scroll_count, heap, nodes, articles = stats['samples'][-1]
+        heap_text = f"{heap/1024/1024:.0f} MB JS heap, " if heap else ""
+        print(f"Browser at scroll #{scroll_count}: {heap_text}{nodes} DOM nodes, {articles} tweets "
+              f"({stats['pruned']} pruned)")
+    scan_times = stats['scan_times']
+    if len(scan_times) >= 2:
+        window = max(1, min(100, len(scan_times) // 2))
+        first = statistics.median(scan_times[:window])
+        recent = statistics.median(scan_times[-window:])
+        print(f"Media scan latency: median {first*1000:.0f} ms over the first {window} scans, "
+              f"{recent*1000:.0f} ms over the last {window}")
+
+def load_sync_state():
+    """Return the newest media keys recorded by the previous sync run"""
+    if os.path.exists(SYNC_STATE_FILE):
+        try:
+            with open(SYNC_STATE_FILE, 'r') as f:
+                return json.load(f).get('newest_keys', [])
+        except Exception as e:
+            print(f"Error loading sync state: {e}")
+    return []
+
+def new_sync_tracker():
+    """State for sync mode: keys known before this run and the current known streak"""
+    previous_keys = load_sync_state()
+    print(f"Sync mode: stopping after {SYNC_KNOWN_STREAK} consecutive known media items "
+          f"({len(previous_keys)} keys from the last run)")
+    return {'previous_keys': previous_keys, 'known': set(previous_keys),
+            'seen': set(), 'new_keys': [], 'streak': 0}
+
+def update_sync_streak(sync, media_urls):
+    """
+    Feed harvested URLs in page order; returns True once SYNC_KNOWN_STREAK
+    consecutive media from earlier runs have been seen. Media already seen in
+    this run neither extend nor break the streak.
+    """
+    for url in media_urls:
+        key = canonical_media_key(url)
+        if key in sync['seen']:
+            continue
+        sync['seen'].add(key)
+
+        if key in sync['known'] or is_media_downloaded(key):
+            sync['streak'] += 1
+            if sync['streak'] >= SYNC_KNOWN_STREAK:
+                return True
+        else:
+            sync['streak'] = 0
+            sync['new_keys'].append(key)
+    return False
+
+def save_sync_state(sync):
+    """Persist the newest keys seen (this run's first, then the previous run's)"""
+    newest_keys = list(dict.fromkeys(sync['new_keys'] + sync['previous_keys']))[:SYNC_STATE_SIZE]
+    os.makedirs(os.path.dirname(SYNC_STATE_FILE), exist_ok=True)
+    temp_path = SYNC_STATE_FILE + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                   'newest_keys': newest_keys}, f)
+    os.replace(temp_path, SYNC_STATE_FILE)
+    print(f"Sync state saved: {len(sync['new_keys'])} new media items this run")
+
+def optimized_scroll_for_media(driver, target_count=TARGET_MEDIA_COUNT, pipeline=None):
     """
     Optimized scrolling function to find large amounts of media
-    with progress tracking and checkpoint saving
+    with progress tracking and checkpoint saving. With a download pipeline,
+    each new URL is queued for download as soon as it is found.
     """
     print(f"Starting optimized scrolling to collect {target_count} media items...")
     
-    # Load checkpoint if available
-    all_media_urls, downloaded_count, start_scroll_count = load_checkpoint()
+    # Load checkpoint if available, keyed by canonical media key
+    checkpoint_urls, _, start_scroll_count = load_checkpoint()
+    all_media_urls = {canonical_media_key(url): url for url in checkpoint_urls}
+    
+    # Sync runs start from the top of the feed and count the target from this run's finds
+    sync = None
+    if SYNC_MODE:
+        sync = new_sync_tracker()
+        start_scroll_count = 0
+        target_count += len(all_media_urls)
     
     # Track progress
     scroll_count = start_scroll_count
@@ -257,53 +1881,85 @@ def optimized_scroll_for_media(driver, target_count=TARGET_MEDIA_COUNT):
     last_media_count = len(all_media_urls)
     last_save_time = time.time()
     
+    # Media seen on the page this run, as opposed to carried over from the checkpoint
+    session_keys = set()
+    
+    # Hand leftovers from the checkpoint to the download workers straight away
+    on_new_media = None
+    if pipeline is not None:
+        pipeline.resume()
+        on_new_media = pipeline.submit
+    
+    # Read media from the timeline responses, or start collecting newly inserted media nodes
+    capture = LikesNetworkCapture() if CAPTURE_MODE == "network" else None
+    resolver = VideoResolver() if capture is None and RESOLVE_VIDEOS else None
+    if capture is None and INCREMENTAL_HARVEST:
+        install_media_observer(driver)
+    
+    # Adaptive pacing state and the request tracker used to detect when loading has settled
+    pacing = new_scroll_pacing()
+    read_page_activity(driver)
+    browser_stats = new_browser_stats()
+    metrics = get_metrics()
+    
     # Scroll until we have enough media or reach the end
     while len(all_media_urls) < target_count and scroll_count < MAX_SCROLLS:
-        # Extract media from current viewport
-        current_media = extract_media_from_page(driver)
-        new_media_count = 0
+        iteration_start = time.perf_counter()
+        
+        # Extract media added since the last tick (or rescan the page in full-scan mode)
+        scan_start = time.perf_counter()
+        current_media = harvest_new_media(driver, capture, resolver)
+        scan_time = time.perf_counter() - scan_start
+        browser_stats['scan_times'].append(scan_time)
+        metrics.observe('scan_seconds', scan_time)
+        metrics.inc('scans')
         
         # Add to our collection, track how many new items we found
-        for media_url in current_media:
-            if media_url not in all_media_urls and not is_profile_image(media_url):
-                all_media_urls.add(media_url)
-                new_media_count += 1
+        new_media_count = merge_media_urls(all_media_urls, current_media, on_new_media, session_keys)
+        
+        # In sync mode, stop once we are back among media from earlier runs
+        if sync is not None and update_sync_streak(sync, current_media):
+            print(f"Sync: {SYNC_KNOWN_STREAK} consecutive known media items found, reached the previous run's high-water mark")
+            break
         
         # Report progress on regular intervals
         if scroll_count % PROGRESS_REPORT_FREQ == 0 or new_media_count > 0:
             print(f"Scroll #{scroll_count}: Found {new_media_count} new media items")
             print(f"Total collected: {len(all_media_urls)}/{target_count} ({len(all_media_urls)/target_count*100:.1f}%)")
+        if scroll_count % (PROGRESS_REPORT_FREQ * 10) == 0:
+            report_scroll_latency(pacing)
+            report_browser_metrics(browser_stats)
+        
+        # Everything above the viewport has been harvested; release it before the tab grows further
+        control_browser_memory(driver, browser_stats, scroll_count)
         
         # Scroll down with overlap to ensure we don't miss anything
         viewport_height = driver.execute_script("return window.innerHeight")
+        baseline = read_page_activity(driver)
         # Use smaller scroll increment for more reliable content loading
         driver.execute_script(f"window.scrollBy(0, {int(viewport_height * 0.6)});")
         
         scroll_count += 1
-        time.sleep(SCROLL_PAUSE_TIME)
+        wait_time = wait_for_new_content(driver, baseline, pacing)
         
-        # Every 10 scrolls, do a more comprehensive scan
-        if scroll_count % 20 == 0:
+        # Every 20 scrolls, do a more comprehensive scan (incremental mode only rescans on demand)
+        if capture is None and not INCREMENTAL_HARVEST and scroll_count % 20 == 0:
             print(f"Performing comprehensive scan at scroll #{scroll_count}...")
             
             # First scroll back up a bit to ensure new content is fully loaded
+            baseline = read_page_activity(driver)
             driver.execute_script(f"window.scrollBy(0, {int(-viewport_height * 0.3)});")
-            time.sleep(SCROLL_PAUSE_TIME)
+            wait_for_new_content(driver, baseline, pacing)
             
             # Now do a thorough scan
-            full_page_media = extract_media_from_page(driver)
-            new_count = 0
-            for media_url in full_page_media:
-                if media_url not in all_media_urls and not is_profile_image(media_url):
-                    all_media_urls.add(media_url)
-                    new_count += 1
+            new_count = merge_media_urls(all_media_urls, extract_media_from_page(driver, resolver), on_new_media, session_keys)
             
             print(f"Comprehensive scan found {new_count} additional media items")
             print(f"Total: {len(all_media_urls)}/{target_count} ({len(all_media_urls)/target_count*100:.1f}%)")
         
         # Save checkpoint periodically (every 50 scrolls or when we find a significant number of new media)
         if scroll_count % 50 == 0 or (new_media_count > 10 and time.time() - last_save_time > 60):
-            save_checkpoint(all_media_urls, downloaded_count, scroll_count)
+            save_checkpoint(all_media_urls.values(), scroll_count)
             last_save_time = time.time()
         
         # Check if we've reached the end
@@ -317,13 +1973,19 @@ def optimized_scroll_for_media(driver, target_count=TARGET_MEDIA_COUNT):
                 print("No new content detected after multiple scrolls.")
                 
                 # Try forcing a full height update
+                baseline = read_page_activity(driver)
                 driver.execute_script("window.scrollTo(0, 0);")  # Scroll to top
-                time.sleep(SCROLL_PAUSE_TIME)
+                wait_for_new_content(driver, baseline, pacing, SCROLL_MAX_WAIT)
+                baseline = read_page_activity(driver)
                 driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")  # Scroll to bottom
-                time.sleep(SCROLL_PAUSE_TIME * 2)
+                wait_for_new_content(driver, baseline, pacing, SCROLL_MAX_WAIT * 2)
                 
                 final_height = driver.execute_script("return document.body.scrollHeight")
                 if final_height == new_height:
+                    if capture is None and INCREMENTAL_HARVEST:
+                        # Run the full scan once on demand so nothing the observer missed is lost
+                        new_count = merge_media_urls(all_media_urls, extract_media_from_page(driver, resolver), on_new_media, session_keys)
+                        print(f"Final comprehensive scan found {new_count} additional media items")
                     print(f"Reached end of available content after {scroll_count} scrolls")
                     break
                 else:
@@ -339,201 +2001,1414 @@ def optimized_scroll_for_media(driver, target_count=TARGET_MEDIA_COUNT):
         # Keep track of media count to detect when we stop finding new media
         last_media_count = len(all_media_urls)
         
+        iteration_time = time.perf_counter() - iteration_start
+        metrics.observe('scroll_iteration_seconds', iteration_time)
+        metrics.inc('scrolls')
+        metrics.log('scroll', scroll_count=scroll_count, new_media=new_media_count, total_media=len(all_media_urls),
+                    scan_seconds=round(scan_time, 4), wait_seconds=round(wait_time, 4), seconds=round(iteration_time, 4))
+        
         # Check if we've reached our target
         if len(all_media_urls) >= target_count:
             print(f"Target reached! Found {len(all_media_urls)} media items.")
             break
     
     print(f"Scrolling complete - processed {scroll_count} scrolls")
+    report_scroll_latency(pacing)
+    report_browser_metrics(browser_stats)
+    if sync is not None:
+        save_sync_state(sync)
     print(f"Found {len(all_media_urls)} total media URLs to download")
     
     # Save final checkpoint
-    save_checkpoint(all_media_urls, downloaded_count, scroll_count)
+    save_checkpoint(all_media_urls.values(), scroll_count)
+    if _session_recorder is not None:
+        _session_recorder.record_result(all_media_urls[key] for key in session_keys)
+    
+    return list(all_media_urls.values())
+
+# Custom headers can help with downloading
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Referer': 'https://twitter.com/'
+}
+
+_worker_state = threading.local()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def new_download_session():
+    """Create a connection-pooled HTTP session with the download headers"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(DOWNLOAD_HEADERS)
+    return session
+
+def get_download_session():
+    """Return this worker's HTTP session, creating it on first use (sessions are not thread-safe)"""
+    session = getattr(_worker_state, 'session', None)
+    if session is None:
+        session = _worker_state.session = new_download_session()
+    return session
+
+def host_slot(url):
+    """Semaphore capping simultaneous connections to the URL's host"""
+    host = urllib.parse.urlparse(url).netloc
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_slots[host]
+
+def is_downloadable_media_url(url):
+    """Check that a URL points at tweet media rather than profile images or UI assets"""
+    return parse_media_url(url).downloadable
+
+def build_media_filename(url, content_type, index):
+    """Build the '{index}_{media_id}{filename}' name used inside the batch folders"""
+    media = parse_media_url(url)
+    is_video = media.kind == 'video' or VIDEO_HOST_MARKER in url
+    
+    # Extract filename from URL
+    parsed_url = urllib.parse.urlparse(url)
+    path = parsed_url.path
+    
+    # Get base filename from URL path
+    base_filename = os.path.basename(path).split('?')[0]
+    
+    # Determine file extension based on content type or default to jpg/mp4
+    if 'video' in content_type or is_video:
+        extension = 'mp4'
+    elif 'image' in content_type:
+        if 'jpeg' in content_type or 'jpg' in content_type:
+            extension = 'jpg'
+        elif 'png' in content_type:
+            extension = 'png'
+        elif 'gif' in content_type:
+            extension = 'gif'
+        else:
+            extension = 'jpg'  # Default for images
+    else:
+        # Default based on URL patterns
+        if is_video:
+            extension = 'mp4'
+        else:
+            extension = 'jpg'
+    
+    # Ensure we have a file extension
+    if '.' not in base_filename or base_filename.split('.')[-1] not in ['jpg', 'jpeg', 'png', 'gif', 'mp4', 'webm', 'mov', 'ts']:
+        filename = f"{base_filename}.{extension}"
+    else:
+        filename = base_filename
+    
+    # Make sure filename is valid
+    filename = re.sub(r'[\\/*?:"<>|]', "", filename)
+    
+    # Add media ID (or video ID) and index for uniqueness
+    media_id = f"{media.media_id}_" if media.kind != 'url' else ''
     
-    return list(all_media_urls)
+    # Use index and media_id for uniqueness
+    return f"{index+1}_{media_id}{filename}"
 
-def download_media(media_urls, download_folder, start_index=0):
+# HTTP statuses that mean the host is throttling us rather than failing
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Returned by download_single_media when a host kept throttling the request
+DOWNLOAD_DEFERRED = 'deferred'
+
+class HostThrottled(requests.exceptions.RequestException):
+    """The host answered with a throttling status; it has already been paused"""
+
+def check_throttled(response, url, attempt):
     """
-    Download media with improved error handling and resumption
+    On HTTP 429/503, pause the URL's host for Retry-After (or a backoff) and
+    raise HostThrottled so the caller retries, and defers the file if the
+    host keeps throttling it.
     """
-    if not os.path.exists(download_folder):
-        os.makedirs(download_folder)
-    
-    # Load checkpoint to get download progress
-    _, downloaded_count, _ = load_checkpoint()
-    start_index = max(start_index, downloaded_count)
+    if response.status_code not in THROTTLE_STATUS_CODES:
+        return
+    get_metrics().inc('throttled_responses')
+    delay = parse_retry_after(response.headers.get('Retry-After'))
+    if delay is None:
+        delay = backoff_delay(attempt)
+    response.close()
+    host = urllib.parse.urlparse(url).netloc
+    host_bucket(url).pause(delay)
+    print(f"Throttled (HTTP {response.status_code}), pausing {host} for {delay:.1f}s")
+    raise HostThrottled(f"HTTP {response.status_code} from {host}")
+
+class TokenBucket:
+    """
+    Per-host request budget refilled at a steady rate. acquire() blocks until a
+    token is available, and pause() stops the host entirely for a Retry-After
+    period so every worker backs off together.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+_host_buckets = {}
+_host_buckets_lock = threading.Lock()
+
+def host_bucket(url):
+    """Token bucket pacing requests to the URL's host"""
+    host = urllib.parse.urlparse(url).netloc
+    with _host_buckets_lock:
+        if host not in _host_buckets:
+            _host_buckets[host] = TokenBucket(HOST_REQUESTS_PER_SECOND, HOST_BURST)
+        return _host_buckets[host]
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for the given zero-based attempt"""
+    ceiling = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+def file_sha256(path, digest=None):
+    """Feed a file's bytes into a sha256 digest (a new one unless given) and return it"""
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+def partial_path(download_folder, url):
+    """Stable location of the in-progress '.part' file for a media URL"""
+    safe_key = re.sub(r'[^A-Za-z0-9_-]', '_', canonical_media_key(url))[:120]
+    return os.path.join(download_folder, '.partial', f"{safe_key}.part")
+
+def read_part_source(part_path):
+    """URL and validators saved next to a '.part' file, or None"""
+    try:
+        with open(part_path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_part_source(part_path, url, response, multipart=False):
+    """Remember which URL (and which version of it) a '.part' file holds"""
+    source = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'multipart': multipart,
+    }
+    with open(part_path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(source, f)
+
+def discard_part(part_path):
+    for path in (part_path, part_path + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def resume_validator(source):
+    """Value for If-Range: a strong ETag, else Last-Modified, else None"""
+    etag = source.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return source.get('last_modified')
+
+def expected_size(response):
+    """Total size of the resource from Content-Range or Content-Length, if known"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    if response.headers.get('Content-Length') and not response.headers.get('Content-Encoding'):
+        return int(response.headers['Content-Length'])
+    return None
+
+def download_ranges(url, part_path, total_size):
+    """
+    Fetch a large file as MULTIPART_SEGMENTS parallel byte ranges written into
+    a preallocated '.part' file. Each segment takes its own host slot and token
+    and uses its own session, so the caller must not hold a slot for the host.
+    """
+    with open(part_path, 'wb') as f:
+        f.truncate(total_size)
     
-    # Create subdirectories by batch for better organization
-    batch_folder = os.path.join(download_folder, f"batch_{start_index//1000+1}")
-    if not os.path.exists(batch_folder):
-        os.makedirs(batch_folder)
+    segment_size = -(-total_size // MULTIPART_SEGMENTS)
+    bucket = host_bucket(url)
     
-    # Statistics tracking
-    successful_downloads = 0
-    skipped_urls = 0
-    failed_downloads = 0
+    def fetch_segment(start):
+        end = min(start + segment_size, total_size) - 1
+        bucket.acquire()
+        headers = {'Range': f"bytes={start}-{end}", 'Accept-Encoding': 'identity'}
+        with host_slot(url), new_download_session() as session, \
+                session.get(url, stream=True, timeout=30, headers=headers) as response:
+            check_throttled(response, url, 0)
+            if response.status_code != 206:
+                raise requests.exceptions.RequestException(f"Range request returned HTTP {response.status_code}")
+            written = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+        if written != end - start + 1:
+            raise requests.exceptions.ConnectionError(f"Range {start}-{end} ended after {written} bytes")
     
-    # Filter out known non-media URLs first
-    filtered_urls = []
-    for url in media_urls:
-        # Skip URLs that don't contain media or are profile images
-        if is_profile_image(url):
-            skipped_urls += 1
+    with ThreadPoolExecutor(max_workers=MULTIPART_SEGMENTS) as executor:
+        for future in [executor.submit(fetch_segment, start) for start in range(0, total_size, segment_size)]:
+            future.result()
+
+HLS_BANDWIDTH_PATTERN = re.compile(r'[:,]BANDWIDTH=(\d+)')
+HLS_MAP_PATTERN = re.compile(r'#EXT-X-MAP:URI="([^"]+)"')
+
+def select_best_hls_rendition(playlist_text, playlist_url):
+    """Return the highest-bandwidth rendition of an HLS master playlist (or the playlist itself)"""
+    best_uri = None
+    best_bandwidth = -1
+    lines = [line.strip() for line in playlist_text.splitlines() if line.strip()]
+    for i, line in enumerate(lines):
+        if not line.startswith('#EXT-X-STREAM-INF') or i + 1 >= len(lines) or lines[i + 1].startswith('#'):
             continue
+        match = HLS_BANDWIDTH_PATTERN.search(line)
+        bandwidth = int(match.group(1)) if match else 0
+        if bandwidth > best_bandwidth:
+            best_uri, best_bandwidth = lines[i + 1], bandwidth
+    return urllib.parse.urljoin(playlist_url, best_uri) if best_uri else playlist_url
+
+def download_hls_video(url, index, total, download_folder):
+    """
+    Download the best rendition of an HLS stream by concatenating its init
+    segment and media segments into one file. Every request goes through the
+    host's token bucket and connection cap, and throttled streams are retried
+    and deferred like single files. Returns the same values as download_single_media.
+    """
+    batch_folder = os.path.join(download_folder, f"batch_{index // 1000 + 1}")
+    os.makedirs(batch_folder, exist_ok=True)
+    part_path = partial_path(download_folder, url)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    session = get_download_session()
+    metrics = get_metrics()
+    started = time.perf_counter()
+    throttled = False
+    
+    def fetch(request_url, attempt, **kwargs):
+        host_bucket(request_url).acquire()
+        with host_slot(request_url):
+            response = session.get(request_url, timeout=30, **kwargs)
+        check_throttled(response, request_url, attempt)
+        response.raise_for_status()
+        return response
+    
+    for attempt in range(DOWNLOAD_RETRIES):
+        try:
+            print(f"Downloading {index+1}/{total} (HLS): {url}")
+            playlist = fetch(url, attempt)
             
-        # Check for valid media types
-        if not any(pattern in url for pattern in ['/media/', 'video.twimg', 'ext_tw_video_thumb', 'amplify_video']):
-            skipped_urls += 1
-            continue
+            rendition_url = select_best_hls_rendition(playlist.text, url)
+            if rendition_url != url:
+                playlist = fetch(rendition_url, attempt)
+            
+            # fMP4 renditions start with an init map; older streams are MPEG-TS
+            lines = [line.strip() for line in playlist.text.splitlines() if line.strip()]
+            map_match = HLS_MAP_PATTERN.search(playlist.text)
+            segments = [urllib.parse.urljoin(rendition_url, line) for line in lines if not line.startswith('#')]
+            if map_match:
+                segments.insert(0, urllib.parse.urljoin(rendition_url, map_match.group(1)))
+            extension, content_type = ('mp4', 'video/mp4') if map_match else ('ts', 'video/mp2t')
             
-        filtered_urls.append(url)
+            # Segments are not resumable individually, so each attempt starts a fresh file
+            discard_part(part_path)
+            digest = hashlib.sha256()
+            with open(part_path, 'wb') as f:
+                for segment_url in segments:
+                    host_bucket(segment_url).acquire()
+                    with host_slot(segment_url), session.get(segment_url, stream=True, timeout=30) as response:
+                        check_throttled(response, segment_url, attempt)
+                        response.raise_for_status()
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            digest.update(chunk)
+            
+            playlist_name = os.path.basename(urllib.parse.urlparse(url).path)
+            filename = build_media_filename(url.replace(playlist_name, playlist_name.replace('.m3u8', f".{extension}")), content_type, index)
+            full_path = os.path.join(batch_folder, filename)
+            os.replace(part_path, full_path)
+            file_size = os.path.getsize(full_path)
+            metrics.inc('download_bytes', file_size)
+            metrics.observe('download_seconds', time.perf_counter() - started)
+            print(f"✓ Downloaded {full_path} ({file_size/1024:.1f} KB, {len(segments)} segments)")
+            return file_size, full_path, digest.hexdigest()
+        
+        except HostThrottled:
+            throttled = True
+        except requests.exceptions.RequestException as e:
+            throttled = False
+            metrics.inc('download_errors')
+            print(f"Download attempt {attempt+1} failed: {e}")
+            if attempt + 1 < DOWNLOAD_RETRIES:
+                time.sleep(backoff_delay(attempt))
+    
+    if throttled:
+        print(f"Still throttled after {DOWNLOAD_RETRIES} attempts, deferring {url} to the end of the run")
+        metrics.inc('downloads_deferred')
+        return DOWNLOAD_DEFERRED
+    
+    print(f"Failed to download after {DOWNLOAD_RETRIES} attempts.")
+    return None
+
+def download_single_media(url, index, total, download_folder):
+    """
+    Download one media file with retries into its batch folder.
+    Data goes to a '.part' file that later attempts (and later runs) resume with
+    HTTP Range requests; the file is renamed into place once complete.
+    The sha256 of the content is computed while streaming, so dedup never has
+    to reread the file. Returns (bytes written, file path, sha256), None if the
+    download failed, or DOWNLOAD_DEFERRED if the host kept throttling it.
+    """
+    # Streams offered only as HLS are assembled from their segments
+    if urllib.parse.urlparse(url).path.endswith('.m3u8'):
+        return download_hls_video(url, index, total, download_folder)
+    
+    # Determine which batch folder to use
+    batch_folder = os.path.join(download_folder, f"batch_{index // 1000 + 1}")
+    os.makedirs(batch_folder, exist_ok=True)
     
-    print(f"Filtered {skipped_urls} non-media URLs. Proceeding to download {len(filtered_urls)} media files.")
+    part_path = partial_path(download_folder, url)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
     
-    # Process actual downloads with retries
-    for i, url in enumerate(filtered_urls[start_index:], start=start_index):
-        # Determine which batch folder to use
-        current_batch = i // 1000 + 1
-        batch_folder = os.path.join(download_folder, f"batch_{current_batch}")
-        if not os.path.exists(batch_folder):
-            os.makedirs(batch_folder)
+    session = get_download_session()
+    bucket = host_bucket(url)
+    throttled = False
+    use_ranges = MULTIPART_SEGMENTS > 1
+    metrics = get_metrics()
+    started = time.perf_counter()
+    
+    for attempt in range(DOWNLOAD_RETRIES):
+        try:
+            print(f"Downloading {index+1}/{total}: {url}")
             
-        max_retries = 3
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                print(f"Downloading {i+1}/{len(filtered_urls)}: {url}")
+            # Pick up where an earlier attempt left off, but only with bytes of this exact URL:
+            # the part file is named by media key, which other variants of a video share
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            source = read_part_source(part_path) if offset else None
+            if offset and (source is None or source.get('url') != url or source.get('multipart')):
+                print(f"Discarding partial file from another source or an unfinished multipart fetch: {part_path}")
+                discard_part(part_path)
+                offset = 0
+            headers = {'Accept-Encoding': 'identity'}
+            if offset:
+                headers['Range'] = f"bytes={offset}-"
+                # The server sends the whole file instead if it changed since the part was written
+                validator = resume_validator(source)
+                if validator:
+                    headers['If-Range'] = validator
+            
+            bucket.acquire()
+            with host_slot(url):
+                # Connect time here includes waiting for the response headers
+                request_start = time.perf_counter()
+                response = session.get(url, stream=True, timeout=30, headers=headers)
+                metrics.observe('download_connect_seconds', time.perf_counter() - request_start)
                 
-                # Custom headers can help with downloading
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive',
-                    'Referer': 'https://twitter.com/'
-                }
+                # Throttled: pause the whole host for Retry-After (or a backoff) and try again
+                check_throttled(response, url, attempt)
                 
-                response = requests.get(url, stream=True, headers=headers, timeout=30)
+                # The partial file no longer matches the resource; start over
+                if response.status_code == 416:
+                    response.close()
+                    discard_part(part_path)
+                    raise requests.exceptions.RequestException("Partial file does not match the remote file")
+                
+                throttled = False
                 response.raise_for_status()
+                if offset and response.status_code != 206:
+                    offset = 0  # Server ignored the Range header
+                elif offset:
+                    print(f"Resuming {url} at {offset/1024:.1f} KB")
                 
                 # Check content type
                 content_type = response.headers.get('Content-Type', '')
+                full_path = os.path.join(batch_folder, build_media_filename(url, content_type, index))
+                size = expected_size(response)
                 
-                # Extract filename from URL
-                parsed_url = urllib.parse.urlparse(url)
-                path = parsed_url.path
-                
-                # Get base filename from URL path
-                base_filename = os.path.basename(path).split('?')[0]
-                
-                # Determine file extension based on content type or default to jpg/mp4
-                if 'video' in content_type or 'video' in url:
-                    extension = 'mp4'
-                elif 'image' in content_type:
-                    if 'jpeg' in content_type or 'jpg' in content_type:
-                        extension = 'jpg'
-                    elif 'png' in content_type:
-                        extension = 'png'
-                    elif 'gif' in content_type:
-                        extension = 'gif'
-                    else:
-                        extension = 'jpg'  # Default for images
-                else:
-                    # Default based on URL patterns
-                    if 'video' in url:
-                        extension = 'mp4'
-                    else:
-                        extension = 'jpg'
-                
-                # Ensure we have a file extension
-                if '.' not in base_filename or base_filename.split('.')[-1] not in ['jpg', 'jpeg', 'png', 'gif', 'mp4', 'webm', 'mov']:
-                    filename = f"{base_filename}.{extension}"
-                else:
-                    filename = base_filename
-                
-                # Make sure filename is valid
-                filename = re.sub(r'[\\/*?:"<>|]', "", filename)
-                
-                # Add media ID and index for uniqueness
-                media_id = ''
-                if '/media/' in url:
-                    media_id_match = re.search(r'/media/([A-Za-z0-9_-]+)', url)
-                    if media_id_match:
-                        media_id = f"{media_id_match.group(1)}_"
-                
-                # Use index and media_id for uniqueness
-                full_path = os.path.join(batch_folder, f"{i+1}_{media_id}{filename}")
-                
-                # Download the file
-                with open(full_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                file_size = os.path.getsize(full_path)
-                if file_size < 1000:  # Less than 1KB is likely an error
-                    print(f"Warning: Downloaded file is very small ({file_size} bytes), may be an error")
-                    # If it's an error page, just continue
-                    if file_size < 200:  # Very small file, likely an error
-                        os.remove(full_path)
-                        raise Exception("Downloaded file too small, likely an error")
-                
-                print(f"✓ Downloaded {full_path} ({file_size/1024:.1f} KB)")
-                successful_downloads += 1
-                
-                # Update checkpoint after successful download
-                downloaded_count = i + 1
-                save_checkpoint(media_urls, downloaded_count, 0)  # 0 for scroll_count since we're just tracking downloads
-                
-                break  # Success, exit retry loop
-                
-            except requests.exceptions.RequestException as e:
-                retry_count += 1
-                print(f"Download attempt {retry_count} failed: {e}")
-                if retry_count < max_retries:
-                    print(f"Retrying in 3 seconds...")
-                    time.sleep(3)
+                multipart = (use_ranges and offset == 0 and size and size >= MULTIPART_MIN_SIZE
+                             and response.headers.get('Accept-Ranges') == 'bytes')
+                if multipart:
+                    response.close()
+                    write_part_source(part_path, url, response, multipart=True)
                 else:
-                    print(f"Failed to download after {max_retries} attempts.")
-                    failed_downloads += 1
-                    break
-            except Exception as e:
+                    # Download the file, hashing the bytes already on disk when resuming
+                    if not offset:
+                        write_part_source(part_path, url, response)
+                    digest = file_sha256(part_path) if offset else hashlib.sha256()
+                    transfer_start = time.perf_counter()
+                    first_byte_at = None
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if first_byte_at is None:
+                                first_byte_at = time.perf_counter()
+                                metrics.observe('download_first_byte_seconds', first_byte_at - transfer_start)
+                            f.write(chunk)
+                            digest.update(chunk)
+                    if first_byte_at is not None:
+                        metrics.observe('download_transfer_seconds', time.perf_counter() - first_byte_at)
+            
+            # Ranges run after this worker's host slot is released, since each segment takes its own
+            if multipart:
+                print(f"Fetching {size/1024/1024:.1f} MB as {MULTIPART_SEGMENTS} parallel ranges")
+                try:
+                    with metrics.timer('download_transfer_seconds'):
+                        download_ranges(url, part_path, size)
+                    # Segments arrive out of order, so hash the finished file once
+                    digest = file_sha256(part_path)
+                except Exception:
+                    # Holes in a preallocated file cannot be resumed; fall back to one stream
+                    discard_part(part_path)
+                    use_ranges = False
+                    raise
+            
+            file_size = os.path.getsize(part_path)
+            if size and file_size != size:
+                raise requests.exceptions.ConnectionError(f"Connection dropped at {file_size}/{size} bytes")
+            
+            if file_size < 1000:  # Less than 1KB is likely an error
+                print(f"Warning: Downloaded file is very small ({file_size} bytes), may be an error")
+                # If it's an error page, just continue
+                if file_size < 200:  # Very small file, likely an error
+                    discard_part(part_path)
+                    raise Exception("Downloaded file too small, likely an error")
+            
+            # Complete: move into place in one step
+            os.replace(part_path, full_path)
+            discard_part(part_path)
+            metrics.inc('download_bytes', file_size - offset)
+            metrics.observe('download_seconds', time.perf_counter() - started)
+            print(f"✓ Downloaded {full_path} ({file_size/1024:.1f} KB)")
+            return file_size, full_path, digest.hexdigest()
+            
+        except HostThrottled:
+            throttled = True
+        except requests.exceptions.HTTPError as e:
+            # Client errors (404, 403, ...) will not fix themselves
+            if e.response is not None and e.response.status_code < 500:
                 print(f"Failed to download {url}: {e}")
-                failed_downloads += 1
-                break
+                return None
+            throttled = False
+            metrics.inc('download_errors')
+            print(f"Download attempt {attempt+1} failed: {e}")
+            if attempt + 1 < DOWNLOAD_RETRIES:
+                time.sleep(backoff_delay(attempt))
+        except requests.exceptions.RequestException as e:
+            throttled = False
+            metrics.inc('download_errors')
+            print(f"Download attempt {attempt+1} failed: {e}")
+            if attempt + 1 < DOWNLOAD_RETRIES:
+                delay = backoff_delay(attempt)
+                print(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+        except Exception as e:
+            print(f"Failed to download {url}: {e}")
+            return None
+    
+    if throttled:
+        print(f"Still throttled after {DOWNLOAD_RETRIES} attempts, deferring {url} to the end of the run")
+        metrics.inc('downloads_deferred')
+        return DOWNLOAD_DEFERRED
+    
+    print(f"Failed to download after {DOWNLOAD_RETRIES} attempts.")
+    return None
+
+def download_batch(items, download_folder):
+    """Download (url, index) pairs on DOWNLOAD_WORKERS threads, yielding (url, result) as each finishes"""
+    total = len(get_journal().entries)
+    executor = ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_WORKERS))
+    futures = {
+        executor.submit(download_single_media, url, index, total, download_folder): url
+        for url, index in items
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # On a stop, files not yet started are dropped and only those in flight finish
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def retry_deferred_downloads(deferred_urls, download_folder, on_result):
+    """
+    Give throttled downloads DEFERRED_RETRY_ROUNDS more passes once the rest of
+    the run is done; whatever is still throttled after that counts as failed.
+    """
+    journal = get_journal()
+    for round_number in range(DEFERRED_RETRY_ROUNDS):
+        if not deferred_urls:
+            break
+        print(f"Retrying {len(deferred_urls)} throttled downloads (round {round_number+1}/{DEFERRED_RETRY_ROUNDS})...")
+        items = [(url, journal.position(canonical_media_key(url))) for url in deferred_urls]
+        deferred_urls = []
+        for url, result in download_batch(items, download_folder):
+            if result == DOWNLOAD_DEFERRED:
+                deferred_urls.append(url)
+            else:
+                on_result(url, result)
+    
+    for url in deferred_urls:
+        on_result(url, None)
+
+def download_media(media_urls, download_folder):
+    """
+    Download media with improved error handling and resumption.
+    Files are fetched by DOWNLOAD_WORKERS threads, each with its own pooled session.
+    Resume is per media key: anything recorded as done whose file is still on
+    disk is skipped, everything pending or failed is fetched again.
+    """
+    if not os.path.exists(download_folder):
+        os.makedirs(download_folder)
+    
+    journal = get_journal()
+    
+    # Statistics tracking
+    successful_downloads = 0
+    failed_downloads = 0
+    downloaded_bytes = 0
+    
+    # Filter out known non-media URLs first
+    filtered_urls = [url for url in media_urls if is_downloadable_media_url(url)]
+    skipped_urls = len(media_urls) - len(filtered_urls)
+    journal.add_urls(filtered_urls)
+    
+    # Keep one URL per media key and drop anything already on disk
+    work = {}
+    for url in filtered_urls:
+        key = canonical_media_key(url)
+        if key not in work and not is_media_downloaded(key):
+            work[key] = url
+    already_downloaded = len(set(map(canonical_media_key, filtered_urls))) - len(work)
+    
+    print(f"Filtered {skipped_urls} non-media URLs, {already_downloaded} already downloaded. Proceeding to download {len(work)} media files.")
+    print(f"Using {DOWNLOAD_WORKERS} download workers, up to {MAX_CONNECTIONS_PER_HOST} connections per host")
+    
+    start_time = time.time()
+    deferred_urls = []
+    
+    def handle_result(url, result):
+        nonlocal successful_downloads, failed_downloads, downloaded_bytes
+        
+        # Record the outcome in the progress journal
+        record_download(url, result)
+        if result is None:
+            failed_downloads += 1
+        else:
+            successful_downloads += 1
+            downloaded_bytes += result[0]
+    
+    items = [(url, journal.position(key)) for key, url in work.items()]
+    for url, result in download_batch(items, download_folder):
+        if result == DOWNLOAD_DEFERRED:
+            deferred_urls.append(url)
+        else:
+            handle_result(url, result)
+    
+    # Throttled files get another chance once everything else is done
+    retry_deferred_downloads(deferred_urls, download_folder, handle_result)
+    
+    journal.sync()
+    
+    elapsed = max(time.time() - start_time, 0.001)
     
     print(f"\nDownload Summary:")
     print(f"- Successfully downloaded: {successful_downloads} files")
     print(f"- Failed downloads: {failed_downloads} files")
+    print(f"- Already downloaded: {already_downloaded} files")
     print(f"- Skipped non-media URLs: {skipped_urls} URLs")
     print(f"- Total processed: {len(media_urls)} URLs")
+    print(f"- Throughput: {downloaded_bytes/1024/1024/elapsed:.2f} MB/s, {successful_downloads/elapsed:.1f} files/s over {elapsed:.0f}s")
 
-def main():
-    # Create session log file
-    log_file = os.path.join(DOWNLOAD_FOLDER, f"scraper_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-    if not os.path.exists(DOWNLOAD_FOLDER):
-        os.makedirs(DOWNLOAD_FOLDER)
+class DownloadPipeline:
+    """
+    Producer/consumer bridge between scrolling and downloading. Media URLs are
+    queued as soon as they are discovered and drained by background download
+    workers; submit() blocks while the queue is full so scrolling cannot run
+    arbitrarily far ahead of the downloads.
+    """
+
+    def __init__(self, download_folder, workers=DOWNLOAD_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+        self.download_folder = download_folder
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.submitted = set()
+        self.successful_downloads = 0
+        self.failed_downloads = 0
+        self.downloaded_bytes = 0
+        self.deferred_urls = []
+        self.start_time = None
+        self.closed = False
+        self.aborted = False
+        self.finished = False
+
+    def start(self):
+        """Start the background download workers"""
+        os.makedirs(self.download_folder, exist_ok=True)
+        self.start_time = time.time()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{n+1}")
+            thread.start()
+            self.threads.append(thread)
+        print(f"Download pipeline started with {self.workers} workers (queue size {self.queue.maxsize})")
+
+    def resume(self):
+        """Queue journaled media that are pending, failed or missing from disk"""
+        pending = get_journal().remaining_urls()
+        if pending:
+            print(f"Queueing {len(pending)} media items left over from the checkpoint")
+        for url in pending:
+            self.submit(url)
+
+    def submit(self, url):
+        """Queue a newly discovered URL, blocking while the queue is full"""
+        if self.closed or not is_downloadable_media_url(url):
+            return
+        key = canonical_media_key(url)
+        journal = get_journal()
+        if key in self.submitted or is_media_downloaded(key):
+            return
+        self.submitted.add(key)
+        journal.add_urls([url])
+        self.queue.put((url, journal.position(key)))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                url, index = item
+                try:
+                    result = download_single_media(url, index, len(get_journal().entries), self.download_folder)
+                    if result == DOWNLOAD_DEFERRED:
+                        with self.lock:
+                            self.deferred_urls.append(url)
+                    else:
+                        self.record_result(url, result)
+                except Exception as e:
+                    # Keep the worker alive: if every worker died, submit() would block forever
+                    print(f"Download worker error on {url}: {e}")
+                    get_metrics().log('error', url=url, error=repr(e))
+                    with self.lock:
+                        self.failed_downloads += 1
+            finally:
+                self.queue.task_done()
+
+    def record_result(self, url, result):
+        record_download(url, result)
+        with self.lock:
+            if result is None:
+                self.failed_downloads += 1
+            else:
+                self.successful_downloads += 1
+                self.downloaded_bytes += result[0]
+
+    def close(self, abort=False):
+        """
+        Stop the workers. Normally every queued URL is downloaded first; with
+        abort=True (stop or crash) queued URLs are dropped and stay pending in
+        the journal, and only downloads already in flight are allowed to finish.
+        An abort also cuts short a normal close that was interrupted while
+        waiting for the queue to drain.
+        """
+        if self.start_time is None or self.finished or self.aborted or (self.closed and not abort):
+            return
+        self.closed = True
+
+        if abort:
+            self.aborted = True
+            dropped = 0
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.queue.task_done()
+                dropped += item is not None
+            print(f"Stopping download pipeline, {dropped} queued items left for the next run...")
+        else:
+            print(f"Waiting for {self.queue.qsize()} queued downloads to finish...")
+
+        # Sentinels from an interrupted close were drained above, so every live worker gets a new one
+        for thread in self.threads:
+            if thread.is_alive():
+                self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        # Throttled files get another chance; on abort they stay pending for the next run
+        if not abort:
+            retry_deferred_downloads(self.deferred_urls, self.download_folder, self.record_result)
+
+        get_journal().sync()
+        self.report()
+        self.finished = True
+
+    def report(self):
+        """Print the download summary for the pipeline"""
+        elapsed = max(time.time() - self.start_time, 0.001)
+        print("\nDownload Summary:")
+        print(f"- Successfully downloaded: {self.successful_downloads} files")
+        print(f"- Failed downloads: {self.failed_downloads} files")
+        print(f"- Total queued: {len(self.submitted)} media items")
+        print(f"- Throughput: {self.downloaded_bytes/1024/1024/elapsed:.2f} MB/s, {self.successful_downloads/elapsed:.1f} files/s over {elapsed:.0f}s")
+
+def perceptual_hash(path):
+    """
+    64-bit difference hash of an image and its pixel count, or (None, 0) if it
+    cannot be decoded. Runs in a worker process, so it must stay module-level.
+    """
+    try:
+        with Image.open(path) as image:
+            pixels = image.width * image.height
+            image.draft('L', (64, 64))  # Let JPEGs decode at a reduced scale
+            values = list(image.convert('L').resize((9, 8)).getdata())
+    except Exception:
+        return None, 0
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (values[row * 9 + col] < values[row * 9 + col + 1])
+    return bits, pixels
+
+def find_near_duplicates(hashes, max_distance=PERCEPTUAL_HASH_DISTANCE):
+    """
+    Return (key, key, distance) for every pair of perceptual hashes within
+    max_distance bits. Hashes are split into max_distance + 1 bands; two hashes
+    that close must agree on at least one whole band, so only keys sharing a
+    band value are compared instead of every pair.
+    """
+    bands = max_distance + 1
+    band_bits = 64 // bands
+    buckets = {}
+    for key, bits in hashes.items():
+        for band in range(bands):
+            value = (bits >> (band * band_bits)) & ((1 << band_bits) - 1)
+            buckets.setdefault((band, value), []).append(key)
+    
+    pairs = {}
+    for keys in buckets.values():
+        for i, first in enumerate(keys):
+            for second in keys[i + 1:]:
+                pair = (first, second)
+                if pair not in pairs:
+                    distance = bin(hashes[first] ^ hashes[second]).count('1')
+                    if distance <= max_distance:
+                        pairs[pair] = distance
+    return [(first, second, distance) for (first, second), distance in pairs.items()]
+
+def dedupe_downloads(download_folder=DOWNLOAD_FOLDER, action=DEDUP_ACTION, perceptual=PERCEPTUAL_DEDUP):
+    """
+    Find byte-identical downloads by sha256 and hard-link or remove the extra
+    copies, optionally listing near-identical images found by perceptual hash.
+    Hashes live in the media index, so each run only hashes files added since
+    the last one (downloads arrive already hashed). Writes DEDUP_REPORT_FILE.
+    """
+    index = get_media_index()
+    start_time = time.time()
+    
+    # Hash files from before content hashing existed, or that changed on disk
+    files = []
+    newly_hashed = 0
+    for key, path in list(index.paths.items()):
+        full_path = os.path.join(download_folder, path)
+        if not os.path.isfile(full_path):
+            continue
+        details = index.details.get(key, {})
+        size = os.path.getsize(full_path)
+        if not details.get('sha256') or details.get('size') != size:
+            index.update(key, sha256=file_sha256(full_path).hexdigest(), size=size)
+            newly_hashed += 1
+        files.append((key, full_path))
+    print(f"Dedup: {len(files)} files, {newly_hashed} newly hashed")
+    
+    # Keep the earliest download of each content hash
+    groups = {}
+    for key, full_path in files:
+        groups.setdefault(index.details[key]['sha256'], []).append((key, full_path))
+    
+    duplicate_groups = []
+    bytes_saved = 0
+    for sha256, members in groups.items():
+        if len(members) < 2:
+            continue
+        keeper = members[0][1]
+        size = index.details[members[0][0]]['size']
+        duplicates = []
+        for key, full_path in members[1:]:
+            if full_path == keeper or os.path.samefile(keeper, full_path):
+                continue  # Already linked or removed by an earlier run
+            try:
+                if action == "hardlink":
+                    temp_path = full_path + '.dedup'
+                    os.link(keeper, temp_path)
+                    os.replace(temp_path, full_path)
+                elif action == "remove":
+                    os.remove(full_path)
+                    index.add(key, keeper, sha256=sha256, size=size)
+                if action in ("hardlink", "remove"):
+                    bytes_saved += size
+                duplicates.append(os.path.relpath(full_path, download_folder))
+            except OSError as e:
+                print(f"Could not {action} {full_path}: {e}")
+        if duplicates:
+            duplicate_groups.append({
+                'sha256': sha256,
+                'size': size,
+                'kept': os.path.relpath(keeper, download_folder),
+                'duplicates': duplicates,
+            })
+    
+    near_duplicates = []
+    newly_phashed = 0
+    if perceptual and Image is None:
+        print("Pillow is not installed, skipping perceptual dedup (pip install Pillow)")
+    elif perceptual:
+        # One image per content hash; videos are skipped
+        images = {}
+        for members in groups.values():
+            key, full_path = members[0]
+            if full_path.rsplit('.', 1)[-1].lower() not in VIDEO_EXTENSIONS:
+                images[key] = full_path
+        todo = [key for key in images if 'phash' not in index.details[key]]
+        newly_phashed = len(todo)
+        if todo:
+            print(f"Computing perceptual hashes for {len(todo)} images...")
+            with ProcessPoolExecutor(max_workers=DEDUP_PROCESSES) as executor:
+                paths = [images[key] for key in todo]
+                for key, (bits, pixels) in zip(todo, executor.map(perceptual_hash, paths, chunksize=32)):
+                    index.update(key, phash=None if bits is None else format(bits, '016x'), pixels=pixels)
+        
+        hashes = {key: int(index.details[key]['phash'], 16) for key in images if index.details[key].get('phash')}
+        for first, second, distance in find_near_duplicates(hashes):
+            # Largest image first: it is the one worth keeping
+            pair = sorted((first, second), key=lambda k: index.details[k].get('pixels', 0), reverse=True)
+            near_duplicates.append({
+                'files': [os.path.relpath(images[k], download_folder) for k in pair],
+                'distance': distance,
+            })
+    
+    # Fold the appended hash records back into one line per file
+    if newly_hashed or newly_phashed or duplicate_groups:
+        index.compact()
+    
+    report = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'action': action,
+        'files_scanned': len(files),
+        'newly_hashed': newly_hashed,
+        'bytes_saved': bytes_saved,
+        'duplicate_groups': duplicate_groups,
+        'near_duplicates': near_duplicates,
+    }
+    temp_path = DEDUP_REPORT_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(temp_path, DEDUP_REPORT_FILE)
+    
+    duplicate_count = sum(len(group['duplicates']) for group in duplicate_groups)
+    print(f"Dedup: {duplicate_count} duplicate files ({action}), {bytes_saved/1024/1024:.1f} MB saved, "
+          f"{len(near_duplicates)} near-duplicate pairs in {time.time() - start_time:.1f}s")
+    print(f"Dedup report written to {DEDUP_REPORT_FILE}")
+    return report
+
+# Leading bytes of each file format the downloader can produce
+FILE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'\x1a\x45\xdf\xa3', 'webm'),
+)
+# Top-level MP4 boxes; anything else at the top level means the structure is broken
+MP4_TOP_LEVEL_BOXES = {b'ftyp', b'styp', b'moov', b'mdat', b'moof', b'mfra', b'sidx', b'free',
+                       b'skip', b'wide', b'uuid', b'meta', b'pdin', b'emsg', b'prft'}
+MPEG_TS_PACKET_SIZE = 188
+
+def sniff_file_format(head):
+    """Name the format of a file from its first bytes, or None"""
+    for signature, file_format in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return file_format
+    if head[4:8] in MP4_TOP_LEVEL_BOXES:
+        return 'mp4'
+    if head[:1] == b'\x47':
+        return 'ts'
+    return None
+
+def check_mp4_boxes(f, file_size):
+    """Walk the top-level MP4 boxes; returns a problem description or None"""
+    offset = 0
+    seen = set()
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return f"truncated box header at offset {offset}"
+        size, box_type = struct.unpack('>I4s', header[:8])
+        if size == 1:
+            if len(header) < 16:
+                return f"truncated box header at offset {offset}"
+            size = struct.unpack('>Q', header[8:16])[0]
+        elif size == 0:
+            size = file_size - offset  # Box runs to the end of the file
+        if box_type not in MP4_TOP_LEVEL_BOXES or size < 8:
+            return f"corrupt box {box_type!r} at offset {offset}"
+        if offset + size > file_size:
+            return f"'{box_type.decode()}' box ends {offset + size - file_size} bytes past the end of the file"
+        seen.add(box_type)
+        offset += size
+    if b'moov' not in seen:
+        return "no 'moov' box (missing index)"
+    if b'mdat' not in seen:
+        return "no 'mdat' box (missing media data)"
+    return None
+
+def check_media_file(path, file_size):
+    """Check a downloaded file's signature and end marker or box structure; returns a problem or None"""
+    if file_size == 0:
+        return "empty file"
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        file_format = sniff_file_format(head)
+        if file_format is None:
+            if head.lstrip()[:1] == b'<':
+                return "HTML or XML page saved as media"
+            return f"unrecognized format (starts with {head[:8].hex()})"
+        if file_format == 'mp4':
+            return check_mp4_boxes(f, file_size)
+        
+        f.seek(max(0, file_size - 32))
+        tail = f.read()
+        if file_format == 'jpeg' and b'\xff\xd9' not in tail:
+            return "JPEG has no end-of-image marker (truncated)"
+        if file_format == 'png' and not tail.endswith(b'IEND\xaeB`\x82'):
+            return "PNG has no IEND chunk (truncated)"
+        if file_format == 'gif' and not tail.endswith(b';'):
+            return "GIF has no trailer (truncated)"
+        if file_format == 'ts':
+            if file_size % MPEG_TS_PACKET_SIZE:
+                return "MPEG-TS file ends in a partial packet (truncated)"
+            f.seek(file_size - MPEG_TS_PACKET_SIZE)
+            if f.read(1) != b'\x47':
+                return "MPEG-TS packet out of sync"
+    return None
+
+def verify_file(full_path, file_size, expected):
+    """Format check, then size and sha256 against the media index (expected may be empty)"""
+    try:
+        if expected.get('size') is not None and expected['size'] != file_size:
+            return f"size {file_size} differs from the {expected['size']} bytes downloaded"
+        problem = check_media_file(full_path, file_size)
+        if problem is None and expected.get('sha256'):
+            if file_sha256(full_path).hexdigest() != expected['sha256']:
+                problem = "content differs from the downloaded file (sha256 mismatch)"
+        return problem
+    except OSError as e:
+        return f"unreadable: {e}"
+
+def load_verify_cache():
+    if os.path.exists(VERIFY_CACHE_FILE):
+        try:
+            with open(VERIFY_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading verify cache: {e}")
+    return {}
+
+def quarantine_file(download_folder, path):
+    """Move a damaged file out of the batch folders; returns its new relative path"""
+    target = os.path.join(download_folder, QUARANTINE_FOLDER, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(os.path.join(download_folder, path), target)
+    return os.path.relpath(target, download_folder)
+
+def verify_downloads(download_folder=DOWNLOAD_FOLDER, workers=VERIFY_WORKERS, quarantine=True, full=False):
+    """
+    Check every file in the batch folders on a thread pool: format signature
+    and end marker (JPEG, PNG, GIF, MPEG-TS) or box structure (MP4), plus the
+    size and sha256 recorded in the media index. Files whose size and mtime
+    match VERIFY_CACHE_FILE passed before and are skipped unless full=True.
+    Damaged files are moved to QUARANTINE_FOLDER and marked failed in the
+    journal, so the next run downloads them again. Returns the URLs to refetch.
+    """
+    index = get_media_index()
+    journal = get_journal()
+    start_time = time.time()
+    cache = {} if full else load_verify_cache()
+    
+    # Index records by file: after dedup with "remove" several keys can share one file
+    keys_by_path = {}
+    for key, path in index.paths.items():
+        keys_by_path.setdefault(os.path.normpath(path), []).append(key)
+    
+    files = []
+    unchanged = {}
+    if os.path.isdir(download_folder):
+        for folder in os.scandir(download_folder):
+            if not folder.is_dir() or not folder.name.startswith('batch_'):
+                continue
+            for entry in os.scandir(folder.path):
+                if not entry.is_file() or entry.name.endswith(('.tmp', '.dedup')):
+                    continue
+                stat = entry.stat()
+                path = os.path.join(folder.name, entry.name)
+                signature = [stat.st_mtime_ns, stat.st_size]
+                if cache.get(path) == signature:
+                    unchanged[path] = signature
+                else:
+                    files.append((path, entry.path, signature))
+    skipped = len(unchanged)
+    print(f"Verify: {len(files) + skipped} files, {skipped} unchanged since the last check, "
+          f"checking {len(files)} with {workers} threads...")
+    
+    def check(item):
+        path, full_path, signature = item
+        keys = keys_by_path.get(path) or [media_key_from_filename(os.path.basename(path))]
+        expected = index.details.get(keys[0], {}) if keys[0] in index.paths else {}
+        return path, keys, signature, verify_file(full_path, signature[1], expected)
+    
+    damaged = []
+    refetch_urls = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, keys, signature, problem in executor.map(check, files):
+            if problem is None:
+                unchanged[path] = signature
+                continue
+            
+            print(f"✗ {path}: {problem}")
+            record = {'path': path, 'problem': problem, 'keys': [key for key in keys if key]}
+            if quarantine:
+                try:
+                    record['moved_to'] = quarantine_file(download_folder, path)
+                except OSError as e:
+                    print(f"Could not move {path}: {e}")
+            # The file is gone from the batch folder, so the journal and index no longer count it as downloaded
+            for key in record['keys']:
+                entry = journal.entries.get(key)
+                if entry is not None and entry['url']:
+                    if quarantine:
+                        journal.set_status(key, 'failed')
+                    refetch_urls.append(entry['url'])
+                    record['url'] = entry['url']
+            if 'url' not in record:
+                print(f"  No URL recorded for {path}; it will be found again on the next full scroll")
+            damaged.append(record)
+    journal.sync()
     
-    # Set up Chrome options for better media loading
+    # Only files that passed are cached, so damaged ones left in place are checked again next time
+    temp_path = VERIFY_CACHE_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(unchanged, f)
+    os.replace(temp_path, VERIFY_CACHE_FILE)
+    
+    report = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'files_checked': len(files),
+        'files_unchanged': skipped,
+        'damaged': damaged,
+    }
+    temp_path = VERIFY_REPORT_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    os.replace(temp_path, VERIFY_REPORT_FILE)
+    
+    print(f"Verify: {len(damaged)} damaged files, {len(refetch_urls)} queued for download again, "
+          f"in {time.time() - start_time:.1f}s")
+    print(f"Verify report written to {VERIFY_REPORT_FILE}")
+    return refetch_urls
+
+def verify_main(redownload=False, full=False, workers=VERIFY_WORKERS):
+    """Verify the archive and optionally download the damaged files again straight away"""
+    try:
+        refetch_urls = verify_downloads(DOWNLOAD_FOLDER, workers, full=full)
+        if redownload and refetch_urls:
+            download_media(refetch_urls, DOWNLOAD_FOLDER)
+        elif refetch_urls:
+            print("Run the scraper again (or verify with --redownload) to fetch them")
+    finally:
+        get_journal().close()
+        get_media_index().close()
+
+def build_chrome_options(lean=LEAN_BROWSER):
+    """
+    Chrome options for the scraper. Every file is fetched again by the
+    downloader, so the lean profile skips what only a human viewer needs:
+    the window, image decoding, media autoplay, the GPU and extensions.
+    """
     chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--start-maximized")  # Start maximized
     chrome_options.add_argument("--disable-notifications")  # Disable notifications
     
-    # Optional arguments to help with media loading
-    chrome_options.add_argument("--disable-features=PreloadMediaEngagementData,MediaEngagementBypassAutoplayPolicies")
-    chrome_options.add_argument("--autoplay-policy=no-user-gesture-required")
+    if lean:
+        if HEADLESS_BROWSER:
+            chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument(f"--window-size={BROWSER_WINDOW_SIZE[0]},{BROWSER_WINDOW_SIZE[1]}")
+        # Image elements keep their src attributes, so the extractor still sees every URL
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--autoplay-policy=user-gesture-required")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-extensions")
+    else:
+        # Set up Chrome options for better media loading
+        chrome_options.add_argument("--start-maximized")  # Start maximized
+        chrome_options.add_argument("--disable-features=PreloadMediaEngagementData,MediaEngagementBypassAutoplayPolicies")
+        chrome_options.add_argument("--autoplay-policy=no-user-gesture-required")
+    
+    # Performance logging lets the network capture read the Likes timeline responses
+    if CAPTURE_MODE == "network":
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
     
     # Anti-detection measures
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
+    return chrome_options
+
+def apply_lean_profile(driver):
+    """Stop the page fetching media files and hide the headless user agent (Chrome DevTools protocol)"""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+        if HEADLESS_BROWSER:
+            user_agent = driver.execute_script("return navigator.userAgent")
+            driver.execute_cdp_cmd('Network.setUserAgentOverride', {'userAgent': user_agent.replace('HeadlessChrome', 'Chrome')})
+    except Exception as e:
+        print(f"Could not apply the lean browser profile: {e}")
+
+class AccountMediaFeed:
+    """
+    Stands in for the DownloadPipeline inside an account worker process:
+    media found while scrolling go to the coordinator's shared queue, which
+    dedups them against every other account before downloading.
+    """
+
+    def __init__(self, media_queue, username):
+        self.media_queue = media_queue
+        self.username = username
+
+    def resume(self):
+        """
+        Send the media in this account's checkpoint that are not on disk yet.
+        Downloads are recorded by the coordinator, so media found in the shared
+        index are marked done in the account's journal here.
+        """
+        pending = [url for url in get_journal().remaining_urls() if not is_media_downloaded(canonical_media_key(url))]
+        if pending:
+            print(f"Sending {len(pending)} media items left over from the checkpoint")
+        for url in pending:
+            self.submit(url)
+
+    def submit(self, url):
+        self.media_queue.put((self.username, url))
+
+def configure_account(account, run_id):
+    """Apply the account's settings overrides and point the per-account files at its own folder"""
+    global X_USERNAME, PROFILE_URL, LIKES_TAB_SELECTOR, CHECKPOINT_FILE, JOURNAL_FILE
+    global SYNC_STATE_FILE, SESSION_COOKIES_FILE, _journal, _metrics
+    globals().update(account.get('settings', {}))
+    username = account['username']
+    account_folder = os.path.join(ACCOUNTS_FOLDER, username)
+    os.makedirs(account_folder, exist_ok=True)
+    
+    X_USERNAME = username
+    PROFILE_URL = f"https://x.com/{username}"
+    LIKES_TAB_SELECTOR = f"a[href='/{username}/likes']"
+    CHECKPOINT_FILE = os.path.join(account_folder, "checkpoint.json")
+    JOURNAL_FILE = os.path.join(account_folder, "progress.jsonl")
+    SYNC_STATE_FILE = os.path.join(account_folder, "sync_state.json")
+    SESSION_COOKIES_FILE = os.path.join(account_folder, "session_cookies.json")
+    _journal = None
+    _metrics = RunMetrics()
+    _metrics.open_log(os.path.join(account_folder, f"scraper_log_{run_id}.txt"))
+    return account_folder
+
+def collect_account(account, media_queue, run_id):
+    """
+    Scroll one account's likes in a worker process, sending each media URL to
+    the coordinator as it is found. Progress goes to the account's own journal
+    so an interrupted account resumes on its own. Returns a short summary.
+    """
+    account_folder = configure_account(account, run_id)
+    start = time.time()
+    output_file = os.path.join(account_folder, f"scraper_output_{run_id}.txt")
+    with open(output_file, 'w', encoding='utf-8') as output, contextlib.redirect_stdout(output):
+        metrics = get_metrics()
+        driver = launch_chrome(build_chrome_options())
+        try:
+            if LEAN_BROWSER:
+                apply_lean_profile(driver)
+            if account.get('login', True):
+                if PERSIST_SESSION and restore_session(driver):
+                    save_session(driver)
+                elif login_to_x(driver, account['username'], account.get('password')) and PERSIST_SESSION:
+                    save_session(driver)
+            if account.get('likes_url'):
+                driver.get(account['likes_url'])
+            else:
+                navigate_to_likes(driver, PROFILE_URL, LIKES_TAB_SELECTOR)
+            
+            with metrics.phase('scroll'):
+                media_urls = optimized_scroll_for_media(driver, account.get('target', TARGET_MEDIA_COUNT),
+                                                        AccountMediaFeed(media_queue, account['username']))
+        finally:
+            driver.quit()
+            get_journal().close()
+            metrics.close()
+    return {'username': account['username'], 'media': len(media_urls), 'seconds': time.time() - start,
+            'output': output_file}
+
+def coordinate_accounts(accounts=None, max_parallel=MAX_PARALLEL_ACCOUNTS):
+    """
+    Collect several accounts at once, each in its own process with its own
+    browser, while this process downloads for all of them through one
+    DownloadPipeline. The pipeline and the shared media index skip media
+    already queued or on disk, so media liked by several accounts is fetched once.
+    """
+    accounts = ACCOUNTS if accounts is None else accounts
+    if not accounts:
+        print("No accounts configured; add them to ACCOUNTS")
+        return []
+    
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+    report_file = os.path.join(DOWNLOAD_FOLDER, f"run_report_{run_id}.json")
+    metrics = get_metrics()
+    metrics.open_log(os.path.join(DOWNLOAD_FOLDER, f"scraper_log_{run_id}.txt"))
+    metrics.log('run_start', accounts=[account['username'] for account in accounts], max_parallel=max_parallel)
+    
+    print(f"Collecting {len(accounts)} accounts, {max_parallel} at a time. "
+          f"Each account's output goes to {ACCOUNTS_FOLDER}/<username>/")
+    # Build the shared media index here, so account workers only ever read it
+    get_media_index()
+    pipeline = DownloadPipeline(DOWNLOAD_FOLDER)
+    pipeline.start()
+    pipeline.resume()
+    summaries = []
+    per_account = {account['username']: 0 for account in accounts}
+    
+    # The download threads are already running, so workers must not be forked from this
+    # process: a child could inherit a lock one of them holds and deadlock on it
+    spawn = multiprocessing.get_context('spawn')
+    try:
+        with metrics.phase('scroll'), spawn.Manager() as manager:
+            # Bounded, so account workers pause when downloads fall behind
+            media_queue = manager.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            with ProcessPoolExecutor(max_workers=max_parallel, mp_context=spawn) as executor:
+                futures = {executor.submit(collect_account, account, media_queue, run_id): account['username']
+                           for account in accounts}
+                
+                # Feed the shared pipeline until every account is done and the queue is empty
+                while True:
+                    try:
+                        username, url = media_queue.get(timeout=1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures):
+                            break
+                        continue
+                    per_account[username] += 1
+                    pipeline.submit(url)
+                
+                for future, username in futures.items():
+                    try:
+                        summary = future.result()
+                        summaries.append(summary)
+                        print(f"{username}: {summary['media']} media in {summary['seconds']:.0f}s")
+                        metrics.log('account_done', **summary)
+                    except Exception as e:
+                        print(f"{username}: collection failed: {e}")
+                        metrics.log('error', account=username, error=repr(e))
+        
+        print(f"Media sent per account: {per_account}, {len(pipeline.submitted)} distinct media queued")
+        with metrics.phase('download'):
+            pipeline.close()
+        if DEDUP_AFTER_DOWNLOAD:
+            with metrics.phase('dedup'):
+                dedupe_downloads(DOWNLOAD_FOLDER)
+    finally:
+        pipeline.close(abort=True)
+        get_journal().close()
+        get_media_index().close()
+        metrics.print_summary()
+        metrics.write_report(report_file)
+        metrics.log('run_end', report=report_file)
+        metrics.close()
+    return summaries
+
+def main():
+    # Create session log file (structured JSON lines) and the run report next to it
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file = os.path.join(DOWNLOAD_FOLDER, f"scraper_log_{run_id}.txt")
+    report_file = os.path.join(DOWNLOAD_FOLDER, f"run_report_{run_id}.json")
+    if not os.path.exists(DOWNLOAD_FOLDER):
+        os.makedirs(DOWNLOAD_FOLDER)
+    metrics = get_metrics()
+    metrics.open_log(log_file)
+    if PROMETHEUS_TEXTFILE:
+        metrics.export_hooks.append(prometheus_textfile_hook(PROMETHEUS_TEXTFILE))
+    metrics.log('run_start', username=X_USERNAME, target=TARGET_MEDIA_COUNT, capture_mode=CAPTURE_MODE)
+    
+    chrome_options = build_chrome_options()
     
     # Create download folder if it doesn't exist
     if not os.path.exists(DOWNLOAD_FOLDER):
         os.makedirs(DOWNLOAD_FOLDER)
         print(f"Created download folder: {DOWNLOAD_FOLDER}")
     
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+    launch_start = time.time()
+    with metrics.phase('browser_start'):
+        driver = launch_chrome(chrome_options)
+    print(f"Browser started in {time.time() - launch_start:.1f}s")
+    if LEAN_BROWSER:
+        apply_lean_profile(driver)
+    
+    # Background download workers fed while the feed is still being scrolled
+    pipeline = DownloadPipeline(DOWNLOAD_FOLDER) if PIPELINED_DOWNLOADS else None
+    if RECORD_SESSION:
+        start_session_recording(os.path.join(DOWNLOAD_FOLDER, f"session_{run_id}.jsonl.gz"))
     
     try:
         print("=" * 50)
@@ -545,48 +3420,114 @@ def main():
         print("=" * 50)
         
         # Check for existing checkpoint
-        if os.path.exists(CHECKPOINT_FILE):
+        if os.path.exists(JOURNAL_FILE) or os.path.exists(CHECKPOINT_FILE):
             print("Found existing checkpoint. Resuming previous session...")
-            loaded_urls, downloaded_count, _ = load_checkpoint()
+            _, downloaded_count, _ = load_checkpoint()
+            remaining_urls = [url for url in get_journal().remaining_urls()
+                              if not is_media_downloaded(canonical_media_key(url))]
             
             # Ask if user wants to continue downloading from checkpoint
-            if downloaded_count > 0 and len(loaded_urls) > downloaded_count:
-                choice = input(f"Continue downloading remaining {len(loaded_urls) - downloaded_count} items? (y/n): ")
+            if downloaded_count > 0 and remaining_urls:
+                choice = input(f"Continue downloading remaining {len(remaining_urls)} items? (y/n): ")
                 
                 if choice.lower() == 'y':
                     print("Continuing download from checkpoint...")
                     # Skip login and scrolling, just download remaining items
-                    download_media(list(loaded_urls), DOWNLOAD_FOLDER, downloaded_count)
+                    with metrics.phase('download'):
+                        download_media(remaining_urls, DOWNLOAD_FOLDER)
+                    if DEDUP_AFTER_DOWNLOAD:
+                        with metrics.phase('dedup'):
+                            dedupe_downloads(DOWNLOAD_FOLDER)
                     print("Checkpoint download complete! Run the script again to collect more items.")
                     return
         
         # Login and navigate to likes page
-        login_to_x(driver, X_USERNAME, X_PASSWORD)
-        navigate_to_likes(driver, PROFILE_URL, LIKES_TAB_SELECTOR)
+        # Reuse the saved session when it is still valid, otherwise log in
+        login_start = time.time()
+        with metrics.phase('login'):
+            if PERSIST_SESSION and restore_session(driver):
+                save_session(driver)  # Pick up refreshed tokens
+            elif login_to_x(driver, X_USERNAME, X_PASSWORD) and PERSIST_SESSION:
+                save_session(driver)
+            navigate_to_likes(driver, PROFILE_URL, LIKES_TAB_SELECTOR)
+        print(f"Logged in and on the likes page in {time.time() - login_start:.1f}s")
         
         # Perform optimized scrolling to collect media URLs
-        all_media_urls = optimized_scroll_for_media(driver, TARGET_MEDIA_COUNT)
+        if pipeline is not None:
+            pipeline.start()
+        with metrics.phase('scroll'):
+            all_media_urls = optimized_scroll_for_media(driver, TARGET_MEDIA_COUNT, pipeline)
         
-        if all_media_urls:
-            print(f"Starting download of {len(all_media_urls)} media files...")
-            download_media(all_media_urls, DOWNLOAD_FOLDER)
-        else:
-            print("No media found to download.")
+        # With the pipeline this phase only covers the downloads still queued when scrolling ended
+        with metrics.phase('download'):
+            if pipeline is not None:
+                # Scrolling is done; wait for the workers to drain the queue
+                pipeline.close()
+            elif all_media_urls:
+                print(f"Starting download of {len(all_media_urls)} media files...")
+                download_media(all_media_urls, DOWNLOAD_FOLDER)
+            else:
+                print("No media found to download.")
+        
+        # Collapse byte-identical files, hashing only what is new since the last run
+        if DEDUP_AFTER_DOWNLOAD:
+            with metrics.phase('dedup'):
+                dedupe_downloads(DOWNLOAD_FOLDER)
             
     except Exception as e:
         print(f"An error occurred: {e}")
+        metrics.log('error', error=repr(e))
         import traceback
         traceback.print_exc()
         
         # Try to save progress before exit
         if 'all_media_urls' in locals() and all_media_urls:
             print("Saving progress before exit...")
-            save_checkpoint(all_media_urls, downloaded_count if 'downloaded_count' in locals() else 0, 
-                           scroll_count if 'scroll_count' in locals() else 0)
+            save_checkpoint(all_media_urls, get_journal().meta.get('scroll_count', 0))
     finally:
         print("Closing browser...")
         driver.quit()
+        stop_session_recording()
+        # On a stop or crash, let in-flight downloads finish and record progress
+        if pipeline is not None:
+            pipeline.close(abort=True)
+        get_journal().close()
+        get_media_index().close()
+        
+        # Timing report for the whole run
+        metrics.print_summary()
+        metrics.write_report(report_file)
+        metrics.log('run_end', report=report_file)
+        metrics.close()
+        print(f"Run report written to {report_file}")
         print("Script execution complete.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download the media from your liked tweets on X/Twitter")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('scrape', help="log in, collect media from the likes page and download it (default)")
+    replay = commands.add_parser('replay', help="re-extract media from a recorded session archive, without a browser")
+    replay.add_argument('archive', help="session_<timestamp>.jsonl.gz written with RECORD_SESSION = True")
+    replay.add_argument('--output', help="write the media URLs found to this file, one per line")
+    replay.add_argument('--processes', type=int, default=REPLAY_PROCESSES,
+                        help="worker processes (default: every CPU core)")
+    accounts = commands.add_parser('accounts', help="collect every account in ACCOUNTS in parallel with shared downloads")
+    accounts.add_argument('--max-parallel', type=int, default=MAX_PARALLEL_ACCOUNTS,
+                          help=f"browser sessions at once (default: {MAX_PARALLEL_ACCOUNTS})")
+    verify = commands.add_parser('verify', help="check downloaded files for truncation and corruption")
+    verify.add_argument('--redownload', action='store_true', help="download damaged files again right away")
+    verify.add_argument('--full', action='store_true', help="recheck files that passed before")
+    verify.add_argument('--workers', type=int, default=VERIFY_WORKERS,
+                        help=f"threads reading files (default: {VERIFY_WORKERS})")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.command == 'replay':
+        replay_main(args.archive, args.output, args.processes)
+    elif args.command == 'accounts':
+        coordinate_accounts(max_parallel=args.max_parallel)
+    elif args.command == 'verify':
+        verify_main(args.redownload, args.full, args.workers)
+    else:
+        main()
\ No newline at end of file